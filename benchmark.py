@@ -0,0 +1,606 @@
+#!/usr/bin/env python3
+"""Script for benchmarking the data pipeline, the model and the line follower
+
+Usage:
+    python benchmark.py loader --labels storage/label.csv --workers 0 1 2 4
+    python benchmark.py train --batch-size 128
+    python benchmark.py inference --model storage/model_int8.pt --video storage/run.avi
+    python benchmark.py preprocess --video storage/run.avi
+    python benchmark.py follower --video storage/run.avi
+    python benchmark.py framebus --seconds 10
+    python benchmark.py variants --models ../model.pth ../model_w050.pth --labels storage/label.csv
+"""
+
+import os
+import time
+import glob
+import tempfile
+import tracemalloc
+import argparse
+import multiprocessing
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+import pandas as pd
+from sklearn.model_selection import train_test_split
+from etrobocon.models import NvidiaModel
+from etrobocon.models.checkpoint import load_checkpoint
+from etrobocon.models.acceleration import (
+    bf16_supported,
+    optimize_model,
+    to_device,
+    autocast,
+)
+from etrobocon.models.inference import (
+    FramePreprocessor,
+    SteeringPredictor,
+    benchmark_latency,
+)
+from etrobocon.utils import (
+    FrameBus,
+    LineFollower,
+    ScanlineFollower,
+    draw_driving_info,
+    iter_video_frames,
+    preprocess_frame,
+    steer_by_camera,
+    ROI,
+    SEARCH_WIDTH,
+)
+from etrobocon.data import (
+    DrivingRecordDataset,
+    ShardDataset,
+    FrameCache,
+    BatchAugmentation,
+    benchmark_data_loader,
+    load_tensor_dataset,
+)
+
+
+def load_dataset(args) -> DrivingRecordDataset:
+    """Create the dataset from a label CSV file or from shards."""
+    if args.shards is not None:
+        return ShardDataset(
+            sorted(path[: -len(".idx.npz")] for path in glob.glob(args.shards))
+        )
+
+    df = pd.read_csv(args.labels)
+    image_paths, steerings = list(df["file_path"]), list(df["distance"])
+    cache = FrameCache(args.cache_dir, image_paths) if args.cache_dir else None
+
+    return DrivingRecordDataset(image_paths, steerings, cache=cache)
+
+
+def benchmark_loader(args):
+    dataset = load_dataset(args)
+    augment = BatchAugmentation()
+
+    results = benchmark_data_loader(
+        dataset,
+        args.batch_size,
+        worker_counts=args.workers,
+        num_batches=args.batches,
+        prefetch_factor=args.prefetch_factor,
+        collate_fn=augment.collate,
+    )
+
+    for num_workers, samples_per_sec in results.items():
+        print(f"num_workers={num_workers:2d}: {samples_per_sec:10.1f} samples/sec")
+
+    best = max(results, key=results.get)
+    print(f"Recommended: num_workers={best}")
+
+
+def benchmark_train(args):
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    criterion = nn.MSELoss()
+
+    # Synthetic batch, the data pipeline is measured by the `loader` benchmark
+    inputs = torch.rand(args.batch_size, 3, 66, 200)
+    labels = torch.randn(args.batch_size, 1)
+
+    modes = [
+        ("fp32", dict(channels_last=False, bf16=False, compile=False)),
+        ("channels_last", dict(channels_last=True, bf16=False, compile=False)),
+        ("bf16", dict(channels_last=False, bf16=True, compile=False)),
+        ("channels_last+bf16", dict(channels_last=True, bf16=True, compile=False)),
+    ]
+    if args.compile:
+        modes += [(f"{name}+compile", dict(mode, compile=True)) for name, mode in modes]
+
+    for name, mode in modes:
+        if mode["bf16"] and not bf16_supported(device):
+            print(f"{name:28s}: bf16 not supported on {device}")
+            continue
+
+        torch.manual_seed(0)
+        model = NvidiaModel().to(device)
+        optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+        train_model = optimize_model(model, mode["channels_last"], mode["compile"])
+
+        def step():
+            batch = to_device(inputs, device, mode["channels_last"])
+            optimizer.zero_grad()
+            with autocast(device, mode["bf16"]):
+                outputs = train_model(batch)
+            loss = criterion(outputs.float(), labels.to(device))
+            loss.backward()
+            optimizer.step()
+
+        for _ in range(args.warmup):
+            step()
+
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            step()
+        elapsed = (time.perf_counter() - start) / args.steps
+
+        print(
+            f"{name:28s}: {elapsed * 1000:8.2f} ms/step, {args.batch_size / elapsed:10.1f} samples/sec"
+        )
+
+
+def load_frames(video_path: str | None, num_frames: int) -> list:
+    """Camera frames of a recording, or synthetic frames if no recording is given."""
+    if video_path is not None:
+        frames = list()
+        for _, chunk in iter_video_frames(video_path):
+            frames.extend(chunk)
+            if len(frames) >= num_frames:
+                break
+        return frames[:num_frames]
+
+    # The latency does not depend on the content
+    rng = np.random.default_rng(0)
+    return [
+        rng.integers(0, 256, (480, 640, 3), dtype=np.uint8) for _ in range(num_frames)
+    ]
+
+
+def benchmark_preprocess(args):
+    frames = load_frames(args.video, args.frames)
+    preprocessor = FramePreprocessor(frames[0].shape)
+
+    def reference(frame):
+        # The steps of `DrivingRecordDataset` without augmentation
+        image = preprocess_frame(frame) / 255
+        return image.transpose(2, 0, 1).astype(np.float32)
+
+    # The output must be bit-identical to the training pipeline
+    for i, frame in enumerate(frames):
+        expected = reference(frame)
+        actual = preprocessor(frame)[0]
+        if expected.tobytes() != actual.tobytes():
+            raise SystemExit(f"Frame {i}: output differs from the training pipeline")
+    print(f"Output of {len(frames)} frames is bit-identical to the training pipeline")
+
+    for name, fn in [("reference", reference), ("FramePreprocessor", preprocessor)]:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for frame in frames:
+                fn(frame)
+        elapsed = (time.perf_counter() - start) / (args.repeat * len(frames))
+
+        # Memory allocated while preprocessing, i.e. the garbage of every frame
+        tracemalloc.start()
+        for frame in frames:
+            fn(frame)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(
+            f"{name:18s}: {elapsed * 1000:6.3f} ms/frame, "
+            f"peak allocation {peak / 1024:8.1f} KiB"
+        )
+
+
+def synthetic_line_rois(num_rois: int, shape=(100, 440)) -> list:
+    """
+    Gray ROIs of a dark, slightly tilted line on a light floor, which drifts by a few pixels per
+    frame like at 20 FPS. Every 20th ROI has no line.
+    """
+    rng = np.random.default_rng(0)
+    x, tilt = shape[1] / 2, 0.0
+    rois = list()
+    for i in range(num_rois):
+        x = float(np.clip(x + rng.normal(0, 4), 40, shape[1] - 40))
+        tilt = float(np.clip(tilt + rng.normal(0, 2), -30, 30))
+
+        roi = rng.normal(200, 10, shape).clip(0, 255).astype(np.uint8)
+        if i % 20 != 19:
+            top, bottom = int(x - tilt), int(x + tilt)
+            cv2.line(roi, (top, 0), (bottom, shape[0] - 1), 30, 25)
+        rois.append(roi)
+
+    return rois
+
+
+def benchmark_follower(args):
+    if args.video is not None:
+        x1, y1, x2, y2 = args.roi
+        rois = [
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)[y1:y2, x1:x2]
+            for frame in load_frames(args.video, args.frames)
+        ]
+    else:
+        rois = synthetic_line_rois(args.frames)
+
+    def contours(roi):
+        try:
+            return steer_by_camera(roi)
+        except ValueError:  # No contour, the line is lost
+            return None
+
+    followers = {
+        "LineFollower": LineFollower(),
+        "LineFollower (tracking)": LineFollower(search_width=args.search_width),
+        "ScanlineFollower": ScanlineFollower(),
+    }
+
+    results = dict()
+    for name, fn in [("steer_by_camera", contours), *followers.items()]:
+        results[name], windows = list(), list()
+        for roi in rois:
+            results[name].append(fn(roi))
+            window = getattr(followers.get(name), "window", None)
+            if window is not None:
+                windows.append(window[1] - window[0])
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for roi in rois:
+                fn(roi)
+        elapsed = (time.perf_counter() - start) / (args.repeat * len(rois))
+        print(
+            f"{name:26s}: {elapsed * 1e6:8.1f} us/frame"
+            + (f", mean search width {np.mean(windows):5.1f} px" if windows else "")
+        )
+
+    # Accuracy against the contour method
+    for name in followers:
+        diffs = [
+            abs(old[0] - new.mx)
+            for old, new in zip(results["steer_by_camera"], results[name])
+            if old is not None and not new.lost
+        ]
+        lost = sum(detection.lost for detection in results[name])
+        print(
+            f"{name:26s}: mx difference mean {np.mean(diffs):.3f} px, "
+            f"max {np.max(diffs):.3f} px, line lost in {lost} of {len(rois)} frames"
+        )
+
+
+# Stages of the run.py loop, with the ROI of run.py
+
+
+def synthetic_line_frames(num_frames: int) -> list:
+    """Camera frames with the drifting line of `synthetic_line_rois` in the ROI of run.py."""
+    x1, y1, x2, y2 = ROI
+    frames = list()
+    for roi in synthetic_line_rois(num_frames, (y2 - y1, x2 - x1)):
+        frame = np.full((480, 640, 3), 200, dtype=np.uint8)
+        frame[y1:y2, x1:x2] = roi[..., np.newaxis]
+        frames.append(frame)
+
+    return frames
+
+
+def _steer(frame, follower):
+    x1, y1, x2, y2 = ROI
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return follower(gray[y1:y2, x1:x2])
+
+
+def _telemetry(frame):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    info = {"mx": 0, "my": 0, "text": {"distance": 0.0, "steer": 0.0}}
+    cv2.imencode(".png", draw_driving_info(gray, info, ROI))
+
+
+def _video_writer(directory, name):
+    fourcc = cv2.VideoWriter_fourcc(*"XVID")
+    return cv2.VideoWriter(os.path.join(directory, name), fourcc, 20.0, (640, 480))
+
+
+def _latency_stats(latencies, elapsed) -> dict:
+    latencies = np.array(latencies) * 1000
+    return {
+        "fps": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+def _bus_control(bus, results):
+    follower = LineFollower()
+    latencies, last_seq, start = list(), -1, None
+    while not bus.closed:
+        seq, frame = bus.latest()
+        if seq == last_seq or frame is None:
+            time.sleep(0.0005)
+            continue
+        start = start or time.perf_counter()  # From the first frame
+        _steer(frame, follower)
+        latencies.append(time.monotonic() - bus.timestamp(seq))
+        last_seq = seq
+    results.put(("control", _latency_stats(latencies, time.perf_counter() - start)))
+
+
+def _bus_recording(bus, directory, results):
+    writer = _video_writer(directory, "bus.avi")
+    count = 0
+    for _, frame in bus.frames(start=0, copy=True):
+        writer.write(frame)
+        count += 1
+    writer.release()
+    results.put(("recording", {"frames": count, "dropped": bus.dropped}))
+
+
+def _bus_telemetry(bus, results):
+    count, last_seq = 0, -1
+    while not bus.closed:
+        seq, frame = bus.latest()
+        if seq == last_seq or frame is None:
+            time.sleep(0.0005)
+            continue
+        _telemetry(frame)
+        count, last_seq = count + 1, seq
+    results.put(("telemetry", {"frames": count}))
+
+
+def benchmark_framebus(args):
+    frames = synthetic_line_frames(100)
+    num_frames = int(args.seconds * args.fps)
+    directory = tempfile.mkdtemp()
+
+    # Single process, every stage runs in sequence on the latest captured frame
+    follower, writer = LineFollower(), _video_writer(directory, "single.avi")
+    latencies, recorded, last = list(), 0, -1
+    start = time.monotonic()
+    while last < num_frames - 1:
+        # The camera captures frame k at start + k / fps, the loop gets the latest one
+        latest = min(int((time.monotonic() - start) * args.fps), num_frames - 1)
+        if latest == last:
+            time.sleep(0.0005)
+            continue
+        frame = frames[latest % len(frames)]
+        _steer(frame, follower)
+        latencies.append(time.monotonic() - (start + latest / args.fps))
+        writer.write(frame)
+        _telemetry(frame)
+        recorded, last = recorded + 1, latest
+    writer.release()
+    single = _latency_stats(latencies, time.monotonic() - start)
+    print(
+        f"single process : control {single['fps']:5.1f} fps, latency p50 "
+        f"{single['p50_ms']:6.2f} ms, p99 {single['p99_ms']:6.2f} ms, "
+        f"recorded {recorded}/{num_frames} frames"
+    )
+
+    # One process per stage, frames shared through the bus
+    bus = FrameBus(slots=args.slots)
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=_bus_control, args=(bus, results)),
+        multiprocessing.Process(target=_bus_recording, args=(bus, directory, results)),
+        multiprocessing.Process(target=_bus_telemetry, args=(bus, results)),
+    ]
+    for process in processes:
+        process.start()
+    time.sleep(1.0)  # Let the readers start
+
+    start = time.monotonic()
+    for k in range(num_frames):
+        time.sleep(max(0.0, start + k / args.fps - time.monotonic()))
+        bus.write(frames[k % len(frames)])
+    time.sleep(0.1)  # Let the readers finish the last frame
+    bus.close()
+
+    stats = dict(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    bus.detach()
+
+    control = stats["control"]
+    print(
+        f"shared memory  : control {control['fps']:5.1f} fps, latency p50 "
+        f"{control['p50_ms']:6.2f} ms, p99 {control['p99_ms']:6.2f} ms, "
+        f"recorded {stats['recording']['frames']}/{num_frames} frames "
+        f"({stats['recording']['dropped']} dropped), "
+        f"telemetry {stats['telemetry']['frames']} frames"
+    )
+    print(f"{os.cpu_count()} CPUs")
+
+
+def benchmark_inference(args):
+    frames = load_frames(args.video, args.frames)
+
+    for model_path in args.model:
+        predictor = SteeringPredictor(model_path, num_threads=args.threads)
+        results = benchmark_latency(predictor, frames, repeat=args.repeat)
+
+        budget = 1000 / args.fps
+        verdict = "OK" if results["p99_ms"] <= budget else "over budget"
+        print(
+            f"{model_path:28s}: mean {results['mean_ms']:6.2f} ms, "
+            f"p50 {results['p50_ms']:6.2f} ms, p95 {results['p95_ms']:6.2f} ms, "
+            f"p99 {results['p99_ms']:6.2f} ms, {results['fps']:7.1f} fps "
+            f"({verdict} for {args.fps} FPS)"
+        )
+
+
+def benchmark_variants(args):
+    # Validation frames of the same split as train.py
+    df = pd.read_csv(args.labels)
+    cache = (
+        FrameCache(args.cache_dir, list(df["file_path"])) if args.cache_dir else None
+    )
+    _, X_val, _, y_val = train_test_split(
+        list(df["file_path"]), list(df["distance"]), test_size=0.2, random_state=6
+    )
+    val_images, val_labels = load_tensor_dataset(X_val, y_val, cache)
+
+    frames = load_frames(None, args.frames)
+
+    rows = list()
+    for model_path in args.models:
+        state = load_checkpoint(model_path)
+        model = NvidiaModel.from_state_dict(state.get("model", state)).eval()
+
+        with torch.inference_mode():
+            val_loss = sum(
+                nn.functional.mse_loss(
+                    model(val_images[start : start + 1024]),
+                    val_labels[start : start + 1024],
+                    reduction="sum",
+                ).item()
+                for start in range(0, len(val_images), 1024)
+            ) / len(val_images)
+
+        predictor = SteeringPredictor(model_path, num_threads=args.threads)
+        latency = benchmark_latency(predictor, frames)
+
+        rows.append(
+            {
+                "model": model_path,
+                "params": sum(p.numel() for p in model.parameters()),
+                "mmacs": model.count_macs() / 1e6,
+                "p50_ms": latency["p50_ms"],
+                "p99_ms": latency["p99_ms"],
+                "val_loss": val_loss,
+            }
+        )
+
+    table = pd.DataFrame(rows).sort_values("p50_ms")
+    print(table.to_string(index=False, float_format="{:.4f}".format))
+
+    # The fastest variant which is almost as accurate as the best one
+    max_loss = table["val_loss"].min() * (1 + args.tolerance)
+    fastest = table[table["val_loss"] <= max_loss].iloc[0]
+    print(
+        f"Recommended: {fastest['model']} (val loss within {args.tolerance:.0%} of the best)"
+    )
+
+
+def add_dataset_arguments(parser: argparse.ArgumentParser) -> None:
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--labels", help="Label CSV file with file_path and distance")
+    source.add_argument("--shards", help="Shard index pattern, e.g. 'shards/*.idx.npz'")
+    parser.add_argument("--cache-dir", help="Preprocessed frame cache directory")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    loader_parser = subparsers.add_parser(
+        "loader", help="Samples/sec of the DataLoader for different worker counts"
+    )
+    add_dataset_arguments(loader_parser)
+    loader_parser.add_argument("--batch-size", type=int, default=128)
+    loader_parser.add_argument("--batches", type=int, default=50)
+    loader_parser.add_argument("--workers", type=int, nargs="+")
+    loader_parser.add_argument("--prefetch-factor", type=int)
+    loader_parser.set_defaults(func=benchmark_loader)
+
+    train_parser = subparsers.add_parser(
+        "train", help="Training step time of the fast CPU training modes"
+    )
+    train_parser.add_argument("--batch-size", type=int, default=128)
+    train_parser.add_argument("--steps", type=int, default=20)
+    train_parser.add_argument("--warmup", type=int, default=3)
+    train_parser.add_argument(
+        "--compile", action="store_true", help="Also measure with torch.compile"
+    )
+    train_parser.set_defaults(func=benchmark_train)
+
+    inference_parser = subparsers.add_parser(
+        "inference", help="Per-frame latency of exported models on the CPU"
+    )
+    inference_parser.add_argument(
+        "--model", nargs="+", required=True, help="Model files (.pt, .onnx or .pth)"
+    )
+    inference_parser.add_argument(
+        "--video", help="Camera recording, synthetic frames if not given"
+    )
+    inference_parser.add_argument("--frames", type=int, default=200)
+    inference_parser.add_argument("--repeat", type=int, default=1)
+    inference_parser.add_argument("--threads", type=int)
+    inference_parser.add_argument(
+        "--fps", type=int, default=20, help="Frame rate the latency budget is based on"
+    )
+    inference_parser.set_defaults(func=benchmark_inference)
+
+    preprocess_parser = subparsers.add_parser(
+        "preprocess",
+        help="Check and time the allocation-free preprocessing of live frames",
+    )
+    preprocess_parser.add_argument(
+        "--video", help="Camera recording, synthetic frames if not given"
+    )
+    preprocess_parser.add_argument("--frames", type=int, default=200)
+    preprocess_parser.add_argument("--repeat", type=int, default=5)
+    preprocess_parser.set_defaults(func=benchmark_preprocess)
+
+    follower_parser = subparsers.add_parser(
+        "follower", help="Time of steer_by_camera and LineFollower per frame"
+    )
+    follower_parser.add_argument(
+        "--video", help="Camera recording, synthetic line images if not given"
+    )
+    follower_parser.add_argument(
+        "--roi",
+        type=int,
+        nargs=4,
+        default=ROI,
+        metavar=("X1", "Y1", "X2", "Y2"),
+    )
+    follower_parser.add_argument(
+        "--search-width",
+        type=int,
+        default=SEARCH_WIDTH,
+        help="Window of the tracking mode",
+    )
+    follower_parser.add_argument("--frames", type=int, default=200)
+    follower_parser.add_argument("--repeat", type=int, default=5)
+    follower_parser.set_defaults(func=benchmark_follower)
+
+    framebus_parser = subparsers.add_parser(
+        "framebus",
+        help="Control latency of the run.py stages in one process and with the frame bus",
+    )
+    framebus_parser.add_argument("--seconds", type=float, default=10.0)
+    framebus_parser.add_argument("--fps", type=float, default=20.0)
+    framebus_parser.add_argument("--slots", type=int, default=8)
+    framebus_parser.set_defaults(func=benchmark_framebus)
+
+    variants_parser = subparsers.add_parser(
+        "variants",
+        help="Parameters, MACs, CPU latency and val loss of trained model variants",
+    )
+    variants_parser.add_argument(
+        "--models", nargs="+", required=True, help="Trained models (.pth)"
+    )
+    variants_parser.add_argument(
+        "--labels", required=True, help="Label CSV file the models were trained on"
+    )
+    variants_parser.add_argument(
+        "--cache-dir", help="Preprocessed frame cache directory"
+    )
+    variants_parser.add_argument("--frames", type=int, default=200)
+    variants_parser.add_argument("--threads", type=int)
+    variants_parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Relative val loss increase accepted for a faster model",
+    )
+    variants_parser.set_defaults(func=benchmark_variants)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
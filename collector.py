@@ -5,8 +5,15 @@ import time
 import socket
 import pickle
 import struct
-from etrobocon.utils import steer_by_camera, draw_driving_info
-from etrobocon.data import REGION_OF_INTEREST
+from etrobocon.unit import Camera
+from etrobocon.utils import (
+    LineFollower,
+    draw_driving_info,
+    DropOldestQueue,
+    Stage,
+    ROI,
+    SEARCH_WIDTH,
+)
 
 
 # User defined constants
@@ -14,15 +21,13 @@ FILE_LABEL = time.strftime(
     "%Y%m%d%H%M%S", time.localtime()
 )  # Label for saved camera capture and steering data
 SPECIFIED_FPS = 20  # PICamera fps
-x1, y1, x2, y2 = REGION_OF_INTEREST  # Region of Interest
+CAMERA_FORMAT = "MJPG"  # Pixel format of the camera, same as run.py
+x1, y1, x2, y2 = ROI  # Region of Interest, same as run.py
+RECORDING_QUEUE_SIZE = 32  # Frames buffered for the video writer, same as run.py
 HOST_IP_ADDRESS = (
     "192.168.137.1"  # The destination IP that the Raspberry Pi will send to
 )
 
-# Camera
-cap = cv2.VideoCapture(0)
-cap.set(cv2.CAP_PROP_FPS, SPECIFIED_FPS)
-
 fourcc = cv2.VideoWriter_fourcc(*"XVID")
 out = cv2.VideoWriter(
     filename=f"storage/{FILE_LABEL}_picamera.avi",
@@ -30,6 +35,9 @@ out = cv2.VideoWriter(
     fps=20.0,
     frameSize=(640, 480),
 )
+# Capture timestamp of every recorded frame, the replay times the frames with these, same as run.py
+timestamps = open(f"storage/{FILE_LABEL}_picamera_timestamps.csv", "w")
+timestamps.write("seq,timestamp\n")
 
 
 # Socket connection for sending camera capture
@@ -37,26 +45,44 @@ client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 client_socket.connect((HOST_IP_ADDRESS, 8485))
 
 
+def record_frame(frame):
+    """Recording stage: write a captured frame to the video and its timestamp next to it."""
+    out.write(frame.image)
+    timestamps.write(f"{frame.seq},{frame.timestamp}\n")
+
+
 def main():
+    follower = LineFollower(search_width=SEARCH_WIDTH)
+
+    # Every frame is queued for the recording stage, so the encoder never delays the grab thread of
+    # the camera, the line detection and the inspection use the newest frame
+    recording_queue = DropOldestQueue(RECORDING_QUEUE_SIZE)
+    recording = Stage("recording", recording_queue, record_frame)
+    recording.start()
+    camera = Camera(
+        0,
+        fps=SPECIFIED_FPS,
+        pixel_format=CAMERA_FORMAT,
+        on_frame=recording_queue.put,
+    )
 
     # Start
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
+    while True:
+        captured = camera.read()
+        if captured is None:
             print("Can't receive frame (stream end?). Exiting ...")
-            return False
-
-        out.write(frame)
+            break
 
-        gray = cv2.cvtColor(frame.copy(), cv2.COLOR_BGR2GRAY)
+        gray = cv2.cvtColor(captured.image, cv2.COLOR_BGR2GRAY)
 
         roi = gray[y1:y2, x1:x2]
 
-        mx, my, _ = steer_by_camera(roi=roi)
+        mx, my, _, _ = follower(roi)
 
         # Draw driving info for inspection
         info = dict()
         info["mx"], info["my"] = mx, my
+        info["text"] = {"record_drop": recording_queue.dropped}
         gray = draw_driving_info(gray, info, (x1, y1, x2, y2))
 
         # Send camera capture
@@ -65,11 +91,19 @@ def main():
         data = pickle.dumps(img_encoded)
         client_socket.sendall(struct.pack("L", len(data)) + data)
 
-        if cv2.waitKey(1) & 0xFF == ord("q") or not ret:
+        if cv2.waitKey(1) & 0xFF == ord("q"):
             break
 
-    cap.release()
+    camera.release()
+    recording_queue.close()
+    recording.join()
+    stats = recording.stats()
+    print(
+        f"camera: {camera.frame_count} frames, "
+        f"recording: {stats['processed']} processed, {stats['dropped']} dropped"
+    )
     out.release()
+    timestamps.close()
 
 
 if __name__ == "__main__":
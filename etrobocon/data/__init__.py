@@ -1,10 +1,23 @@
 from .dataset import (
     transform,
     flip_transform,
+    crop_frame,
+    preprocess_frame,
+    load_tensor_dataset,
     DrivingRecordDataset,
+    ShardDataset,
+    ShardShuffleSampler,
 )
 
+from .augment import BatchAugmentation
+from .cache import FrameCache
+from .loader import seed_worker, create_data_loader, benchmark_data_loader
+from .shard import ShardWriter, ShardReader
+
 from .preprocess import (
     label_dataset,
+    label_video,
+    write_shards,
     balance_dataset,
+    balance_csv,
 )
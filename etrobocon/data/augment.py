@@ -0,0 +1,140 @@
+"""Batch-level Data Augmentation
+
+Vectorized tensor counterpart of `transform` and `flip_transform` in `dataset.py`. Instead of calling
+albumentations once per sample, every augmentation is applied to a whole batch (N, C, H, W) at once,
+so the cost grows with the batch size instead of the number of Python calls.
+"""
+
+import torch
+import torch.nn.functional as F
+from torch.utils.data import default_collate
+
+
+class BatchAugmentation:
+    """
+    Random augmentation of a batch of images and steering labels.
+
+    1. Shift and scale (`ShiftScaleRotate` without rotation, constant zero border)
+    2. `RandomBrightnessContrast`
+    3. `HorizontalFlip`, the steering label of a flipped image is negated
+
+    Every augmentation is applied to each sample independently with its probability. The images are
+    expected to be scaled to [0, 1].
+
+    Example:
+        augment = BatchAugmentation()
+        inputs, labels = augment(inputs, labels)
+    """
+
+    def __init__(
+        self,
+        shift_limit: float = 0.03,
+        scale_limit: float = 0.03,
+        shift_scale_p: float = 0.5,
+        brightness_limit: float = 0.2,
+        contrast_limit: float = 0.2,
+        brightness_contrast_p: float = 0.5,
+        flip_p: float = 0.5,
+    ):
+        """
+        Args:
+            shift_limit (float): Maximum shift as a fraction of the image width and height.
+            scale_limit (float): Maximum relative change of the scale.
+            shift_scale_p (float): Probability of the shift and scale augmentation.
+            brightness_limit (float): Maximum brightness change, relative to the maximum value 1.0.
+            contrast_limit (float): Maximum relative contrast change.
+            brightness_contrast_p (float): Probability of the brightness and contrast augmentation.
+            flip_p (float): Probability of the horizontal flip.
+        """
+        self.shift_limit = shift_limit
+        self.scale_limit = scale_limit
+        self.shift_scale_p = shift_scale_p
+        self.brightness_limit = brightness_limit
+        self.contrast_limit = contrast_limit
+        self.brightness_contrast_p = brightness_contrast_p
+        self.flip_p = flip_p
+
+    def __call__(
+        self, images: torch.Tensor, labels: torch.Tensor
+    ) -> tuple[torch.Tensor, torch.Tensor]:
+        """
+        Augment a batch.
+
+        Args:
+            images (torch.Tensor): Images of shape (N, C, H, W) in [0, 1].
+            labels (torch.Tensor): Steering labels of shape (N, 1).
+
+        Returns:
+            tuple[torch.Tensor, torch.Tensor]: The augmented images and labels.
+        """
+        images = self.shift_scale(images)
+        images = self.brightness_contrast(images)
+        images, labels = self.flip(images, labels)
+
+        return images, labels
+
+    def collate(self, batch: list) -> tuple[torch.Tensor, torch.Tensor]:
+        """`collate_fn` for a `DataLoader`, augments the batch in the loader workers."""
+        images, labels = default_collate(batch)
+        return self(images, labels)
+
+    def _apply(self, n: int, p: float, device: torch.device) -> torch.Tensor:
+        return torch.rand(n, device=device) < p
+
+    def _uniform(self, n: int, limit: float, device: torch.device) -> torch.Tensor:
+        return (torch.rand(n, device=device) * 2 - 1) * limit
+
+    def shift_scale(self, images: torch.Tensor) -> torch.Tensor:
+        n, device = images.shape[0], images.device
+        applied = self._apply(n, self.shift_scale_p, device).nonzero().squeeze(1)
+        m = len(applied)
+        if m == 0:
+            return images
+
+        scale = 1 + self._uniform(m, self.scale_limit, device)
+        # Shift in normalized coordinates ([-1, 1] spans the whole image)
+        shift_x = 2 * self._uniform(m, self.shift_limit, device)
+        shift_y = 2 * self._uniform(m, self.shift_limit, device)
+
+        # Inverse mapping from output to input coordinates: x_in = (x_out - shift) / scale
+        theta = torch.zeros(m, 2, 3, device=device, dtype=images.dtype)
+        theta[:, 0, 0] = 1 / scale
+        theta[:, 1, 1] = 1 / scale
+        theta[:, 0, 2] = -shift_x / scale
+        theta[:, 1, 2] = -shift_y / scale
+
+        # Resample only the selected images
+        selected = images[applied]
+        grid = F.affine_grid(theta, list(selected.shape), align_corners=False)
+        images = images.clone()
+        images[applied] = F.grid_sample(
+            selected, grid, mode="bilinear", padding_mode="zeros", align_corners=False
+        )
+
+        return images
+
+    def brightness_contrast(self, images: torch.Tensor) -> torch.Tensor:
+        n, device = images.shape[0], images.device
+        applied = self._apply(n, self.brightness_contrast_p, device)
+
+        alpha = 1 + self._uniform(n, self.contrast_limit, device)
+        beta = self._uniform(n, self.brightness_limit, device)
+
+        alpha = torch.where(applied, alpha, torch.ones_like(alpha)).view(n, 1, 1, 1)
+        beta = torch.where(applied, beta, torch.zeros_like(beta)).view(n, 1, 1, 1)
+
+        return (images * alpha.to(images.dtype) + beta.to(images.dtype)).clamp_(0, 1)
+
+    def flip(
+        self, images: torch.Tensor, labels: torch.Tensor
+    ) -> tuple[torch.Tensor, torch.Tensor]:
+        n = images.shape[0]
+        applied = self._apply(n, self.flip_p, images.device)
+
+        images = torch.where(applied.view(n, 1, 1, 1), images.flip(-1), images)
+        # Reverse steering angle if the horizontal flip has been performed
+        labels = torch.where(
+            applied.view(n, *[1] * (labels.dim() - 1)), -labels, labels
+        )
+
+        return images, labels
@@ -0,0 +1,155 @@
+"""Preprocessed frame cache
+
+The fixed preprocessing steps of `DrivingRecordDataset` (decode, ROI crop, YUV conversion, blur and
+resize) produce the same result in every epoch. `FrameCache` runs them once and stores the results in
+a memory-mapped uint8 array of shape (N, 66, 200, 3) together with a sidecar JSON index that maps
+every source image to its row. The cache is rebuilt whenever a requested source image is missing from
+the index or its modification time has changed, the rows which are still up to date are copied over.
+
+Files in the cache directory:
+    frames.npy: The preprocessed frames, readable with `np.load(..., mmap_mode="r")`.
+    index.json: Source paths, their modification times and the array shape.
+"""
+
+import os
+import json
+import cv2
+import numpy as np
+from tqdm import tqdm
+from .dataset import preprocess_frame
+
+FRAME_SHAPE = (66, 200, 3)
+
+
+class FrameCache:
+    """
+    Memory-mapped cache of preprocessed frames.
+
+    Attributes:
+        cache_dir (str): Directory holding `frames.npy` and `index.json`.
+        index (dict[str, int]): Mapping from source image path to its row in the cache.
+    """
+
+    FRAMES_FILE = "frames.npy"
+    INDEX_FILE = "index.json"
+
+    def __init__(self, cache_dir: str, image_paths: list[str]):
+        """
+        Opens the cache in `cache_dir`, (re)building it if it does not cover `image_paths`.
+
+        Args:
+            cache_dir (str): Directory for the cache files, created if it does not exist.
+            image_paths (list[str]): The source images which must be available from the cache.
+        """
+        self.cache_dir = cache_dir
+        self._frames = None
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+        image_paths = list(dict.fromkeys(image_paths))  # Remove duplicates, keep order
+        mtimes = [os.path.getmtime(path) for path in image_paths]
+
+        index = self._read_index()
+        if not self._is_valid(index, image_paths, mtimes):
+            index = self._build(image_paths, mtimes, index)
+
+        self.index = {path: row for row, path in enumerate(index["paths"])}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, row):
+        return self.frames[row]
+
+    def __getstate__(self):
+        # The memory map is reopened lazily, e.g. by each `DataLoader` worker
+        state = self.__dict__.copy()
+        state["_frames"] = None
+        return state
+
+    @property
+    def frames(self) -> np.ndarray:
+        """The read-only memory-mapped frames array."""
+        if self._frames is None:
+            self._frames = np.load(
+                os.path.join(self.cache_dir, self.FRAMES_FILE), mmap_mode="r"
+            )
+        return self._frames
+
+    def rows(self, image_paths: list[str]) -> np.ndarray:
+        """
+        Look up the cache rows of the given source images.
+
+        Args:
+            image_paths (list[str]): Source image paths, all of which must be in the cache.
+
+        Returns:
+            np.ndarray: Row indices in the same order as `image_paths`.
+        """
+        return np.array([self.index[path] for path in image_paths], dtype=np.int64)
+
+    def _read_index(self) -> dict | None:
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        frames_path = os.path.join(self.cache_dir, self.FRAMES_FILE)
+        if not (os.path.exists(index_path) and os.path.exists(frames_path)):
+            return None
+
+        with open(index_path, "r") as f:
+            return json.load(f)
+
+    def _is_valid(
+        self, index: dict | None, image_paths: list[str], mtimes: list[float]
+    ) -> bool:
+        if index is None or tuple(index["shape"][1:]) != FRAME_SHAPE:
+            return False
+
+        cached_mtimes = dict(zip(index["paths"], index["mtimes"]))
+        return all(
+            cached_mtimes.get(path) == mtime for path, mtime in zip(image_paths, mtimes)
+        )
+
+    def _build(
+        self, image_paths: list[str], mtimes: list[float], old_index: dict | None
+    ) -> dict:
+        frames_path = os.path.join(self.cache_dir, self.FRAMES_FILE)
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+
+        # Rows of the previous cache which are still up to date are copied instead of recomputed
+        old_frames, old_rows = None, dict()
+        if old_index is not None and tuple(old_index["shape"][1:]) == FRAME_SHAPE:
+            old_frames = np.load(frames_path, mmap_mode="r")
+            old_rows = {
+                (path, mtime): row
+                for row, (path, mtime) in enumerate(
+                    zip(old_index["paths"], old_index["mtimes"])
+                )
+            }
+
+        # Write to temporary files first so that an interrupted build never leaves a valid-looking cache
+        shape = (len(image_paths), *FRAME_SHAPE)
+        frames = np.lib.format.open_memmap(
+            frames_path + ".tmp", mode="w+", dtype=np.uint8, shape=shape
+        )
+        for row, (path, mtime) in enumerate(
+            tqdm(
+                zip(image_paths, mtimes),
+                total=len(image_paths),
+                desc="Building frame cache",
+            )
+        ):
+            if (path, mtime) in old_rows:
+                frames[row] = old_frames[old_rows[(path, mtime)]]
+            else:
+                frames[row] = preprocess_frame(cv2.imread(path))
+        frames.flush()
+        # Close the memory maps before replacing the files
+        del frames, old_frames
+
+        index = {"paths": image_paths, "mtimes": mtimes, "shape": list(shape)}
+        with open(index_path + ".tmp", "w") as f:
+            json.dump(index, f)
+
+        os.replace(frames_path + ".tmp", frames_path)
+        os.replace(index_path + ".tmp", index_path)
+
+        return index
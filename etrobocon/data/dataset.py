@@ -3,9 +3,12 @@
 
 import cv2
 import torch
+import numpy as np
 import albumentations as A
 from albumentations.pytorch import ToTensorV2
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, Sampler
+from etrobocon.utils import crop_frame, preprocess_frame, PIXEL_SCALE
+from .shard import ShardReader
 
 
 transform = A.Compose(
@@ -30,31 +33,78 @@ flip_transform = A.ReplayCompose(
 )
 
 
+def load_tensor_dataset(
+    image_paths, steerings, cache=None, chunk_size: int = 1024
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """
+    Preprocess a whole dataset once, without augmentation, into contiguous tensors.
+
+    The result is the same as the samples of `DrivingRecordDataset` without transforms, which makes it
+    suited for a deterministic validation set held in memory.
+
+    Args:
+        image_paths (list[str]): Image file paths.
+        steerings (list[float]): Steering labels.
+        cache (FrameCache, optional): Cache to read the preprocessed frames from.
+        chunk_size (int): Number of frames converted at a time.
+
+    Returns:
+        tuple[torch.Tensor, torch.Tensor]: The float32 images of shape (N, 3, 66, 200) scaled to [0, 1]
+        and the labels of shape (N, 1).
+    """
+    images = torch.empty((len(image_paths), 3, 66, 200), dtype=torch.float32)
+    rows = cache.rows(image_paths) if cache is not None else None
+
+    for start in range(0, len(image_paths), chunk_size):
+        end = min(start + chunk_size, len(image_paths))
+        if cache is not None:
+            frames = cache.frames[rows[start:end]]
+        else:
+            frames = np.stack(
+                [preprocess_frame(cv2.imread(path)) for path in image_paths[start:end]]
+            )
+        # NHWC to NCHW
+        scaled = torch.from_numpy(np.take(PIXEL_SCALE, frames))
+        images[start:end] = scaled.permute(0, 3, 1, 2)
+
+    labels = torch.tensor(steerings, dtype=torch.float32).unsqueeze(-1)
+
+    return images, labels
+
+
 class DrivingRecordDataset(Dataset):
     """Pytorch dataset together with augmentation methods
 
     1. `ShiftScaleRotate`
     2. `RandomBrightnessContrast`
     3. `HorizontalFlip`
+
+    If a `FrameCache` is given, the preprocessed frames are read from the cache instead of
+    decoding and preprocessing the image files for every sample.
     """
 
-    def __init__(self, image_paths, steerings, transform=None, flip_transform=None):
+    def __init__(
+        self, image_paths, steerings, transform=None, flip_transform=None, cache=None
+    ):
         self.image_paths = image_paths
         self.steerings = steerings
         self.transform = transform
         self.flip_transform = flip_transform
+        self.cache = cache
+        self.cache_rows = cache.rows(image_paths) if cache is not None else None
 
     def __len__(self):
         return len(self.image_paths)
 
+    def load_image(self, idx):
+        """Load the preprocessed uint8 frame of a sample, before scaling and augmentation."""
+        if self.cache is not None:
+            return self.cache[self.cache_rows[idx]]
+
+        return preprocess_frame(cv2.imread(self.image_paths[idx]))
+
     def __getitem__(self, idx):
-        image_path = self.image_paths[idx]
-        image = cv2.imread(image_path)
-        image = image[60:135, :, :]  # ROI
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2YUV)
-        image = cv2.GaussianBlur(image, (3, 3), 0)
-        image = cv2.resize(image, (200, 66))
-        image = image / 255
+        image = self.load_image(idx) / 255
         label = self.steerings[idx]
 
         if self.transform is not None:
@@ -68,8 +118,65 @@ class DrivingRecordDataset(Dataset):
             if transformed_image["replay"]["transforms"][0]["applied"] is True:
                 label = -label
 
+        # HWC to CHW as done by `ToTensorV2`, e.g. when augmenting by batch with `BatchAugmentation`
+        if not isinstance(image, torch.Tensor):
+            image = torch.from_numpy(image.transpose(2, 0, 1))
+
         # Module `Conv2d` supports up to `TensorFloat32`
         image = image.to(torch.float32)
         label = torch.tensor(label, dtype=torch.float32).unsqueeze(-1)
 
         return image, label
+
+
+class ShardDataset(DrivingRecordDataset):
+    """Counterpart of `DrivingRecordDataset` which reads the frames and labels from shards
+
+    The shards are written by `write_shards` or `label_video` and contain the ROI crops of the frames,
+    the remaining preprocessing steps and the augmentation are the same as in `DrivingRecordDataset`.
+    """
+
+    def __init__(self, shard_paths, transform=None, flip_transform=None):
+        self.shards = [ShardReader(path) for path in shard_paths]
+        self.shard_offsets = np.cumsum([0] + [len(shard) for shard in self.shards])
+
+        self.steerings = np.concatenate([shard.labels for shard in self.shards])
+        self.transform = transform
+        self.flip_transform = flip_transform
+
+    def __len__(self):
+        return int(self.shard_offsets[-1])
+
+    def load_image(self, idx):
+        shard_idx = np.searchsorted(self.shard_offsets, idx, side="right") - 1
+        image, _ = self.shards[shard_idx][idx - self.shard_offsets[shard_idx]]
+
+        return preprocess_frame(image, cropped=True)
+
+
+class ShardShuffleSampler(Sampler):
+    """Shard-aware shuffling for `ShardDataset`
+
+    Shuffles the order of the shards and the order of the samples within every shard, but visits the
+    shards one after another so that the reads stay within one large file at a time.
+    Call `set_epoch` before every epoch to get a different order.
+    """
+
+    def __init__(self, dataset: ShardDataset, seed: int = 0):
+        self.shard_offsets = dataset.shard_offsets
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self):
+        return int(self.shard_offsets[-1])
+
+    def __iter__(self):
+        rng = np.random.default_rng((self.seed, self.epoch))
+
+        for shard_idx in rng.permutation(len(self.shard_offsets) - 1):
+            start = self.shard_offsets[shard_idx]
+            end = self.shard_offsets[shard_idx + 1]
+            yield from (start + rng.permutation(end - start)).tolist()
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
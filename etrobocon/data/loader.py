@@ -0,0 +1,138 @@
+"""DataLoader configuration
+
+Factory for the `DataLoader`s of the training script together with a benchmark for choosing the number
+of worker processes on the current machine.
+"""
+
+import os
+import time
+import random
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+
+def seed_worker(worker_id: int) -> None:
+    """
+    Seed `random` and `numpy` in a `DataLoader` worker process.
+
+    PyTorch seeds its own generator differently in every worker, but the generators of `random` and
+    `numpy` (used by albumentations) would otherwise be copies of the parent process, so every worker
+    would produce the same "random" augmentations.
+    """
+    worker_seed = torch.initial_seed() % 2**32
+    np.random.seed(worker_seed)
+    random.seed(worker_seed)
+
+
+def create_data_loader(
+    dataset: Dataset,
+    batch_size: int,
+    shuffle: bool = False,
+    sampler=None,
+    num_workers: int = 0,
+    pin_memory: bool | None = None,
+    persistent_workers: bool | None = None,
+    prefetch_factor: int | None = None,
+    collate_fn=None,
+    seed: int | None = None,
+    drop_last: bool = False,
+) -> DataLoader:
+    """
+    Create a `DataLoader` with the performance related settings exposed.
+
+    Args:
+        dataset (Dataset): The dataset to load from.
+        batch_size (int): Number of samples per batch.
+        shuffle (bool): Whether to reshuffle the samples in every epoch, ignored if `sampler` is given.
+        sampler (Sampler, optional): Custom sampler, e.g. `ShardShuffleSampler`.
+        num_workers (int): Number of worker processes, 0 loads the data in the main process.
+        pin_memory (bool, optional): Copy the batches to page-locked memory. Defaults to `True` if
+            CUDA is available.
+        persistent_workers (bool, optional): Keep the worker processes alive between epochs.
+            Defaults to `True` if `num_workers > 0`. The generators of persistent workers are
+            seeded once, so a run resumed from a checkpoint needs non-persistent workers to
+            continue with the same random numbers.
+        prefetch_factor (int, optional): Number of batches loaded in advance by each worker.
+        collate_fn (callable, optional): Custom collate function, e.g. `BatchAugmentation.collate`.
+        seed (int, optional): Seed of the shuffling and the worker processes, for reproducible runs.
+        drop_last (bool): Drop the last incomplete batch.
+
+    Returns:
+        DataLoader: The configured data loader.
+    """
+    if pin_memory is None:
+        pin_memory = torch.cuda.is_available()
+    if persistent_workers is None:
+        persistent_workers = num_workers > 0
+
+    generator = None
+    if seed is not None:
+        generator = torch.Generator()
+        generator.manual_seed(seed)
+
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle if sampler is None else False,
+        sampler=sampler,
+        num_workers=num_workers,
+        pin_memory=pin_memory,
+        persistent_workers=persistent_workers and num_workers > 0,
+        prefetch_factor=prefetch_factor if num_workers > 0 else None,
+        collate_fn=collate_fn,
+        worker_init_fn=seed_worker,
+        generator=generator,
+        drop_last=drop_last,
+    )
+
+
+def benchmark_data_loader(
+    dataset: Dataset,
+    batch_size: int,
+    worker_counts: list[int] | None = None,
+    num_batches: int = 50,
+    **kwargs,
+) -> dict[int, float]:
+    """
+    Measure the loading throughput for different numbers of worker processes.
+
+    The first batch of every configuration is excluded from the measurement, since it includes the
+    start-up time of the workers.
+
+    Args:
+        dataset (Dataset): The dataset to load from.
+        batch_size (int): Number of samples per batch.
+        worker_counts (list[int], optional): Numbers of workers to try. Defaults to 0, 1, 2, 4, ...
+            up to the number of CPUs.
+        num_batches (int): Number of batches measured per configuration.
+        **kwargs: Further arguments of `create_data_loader`.
+
+    Returns:
+        dict[int, float]: Samples per second for every number of workers.
+    """
+    if worker_counts is None:
+        worker_counts = [0] + [2**i for i in range(8) if 2**i <= os.cpu_count()]
+
+    results = dict()
+    for num_workers in worker_counts:
+        loader = create_data_loader(
+            dataset, batch_size, shuffle=True, num_workers=num_workers, **kwargs
+        )
+        iterator = iter(loader)
+        next(iterator)
+
+        num_samples = 0
+        start = time.perf_counter()
+        for _ in range(num_batches):
+            try:
+                inputs, _ = next(iterator)
+            except StopIteration:
+                break
+            num_samples += len(inputs)
+        elapsed = time.perf_counter() - start
+
+        results[num_workers] = num_samples / elapsed if elapsed > 0 else 0.0
+        del iterator, loader
+
+    return results
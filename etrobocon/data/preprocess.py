@@ -2,55 +2,143 @@
 This module provides functions for labeling and balancing datasets of image frames.
 
 Functions:
-    label_dataset(path_pattern: str, output_csv: str, roi: tuple[int, int, int, int]) -> pd.DataFrame:
+    label_dataset(path_pattern: str, output_csv: str, roi: tuple[int, int, int, int], ...) -> pd.DataFrame:
         Labels all the frame files in the provided path pattern and saves the 'frame-distance' pairs to a CSV file.
+        The work is spread over a process pool and can be resumed from an incremental manifest.
         
-    balance_dataset(df: pd.DataFrame, col_name: str, max_samples: int, num_bins: int) -> pd.DataFrame:
+    label_video(video_path: str, shard_path: str, roi: tuple[int, int, int, int], ...) -> pd.DataFrame:
+        Labels the frames of a recorded video and packs their ROI crops and labels into a shard.
+
+    write_shards(df: pd.DataFrame, output_dir: str, shard_size: int, encoding: str) -> list[str]:
+        Packs the frames of a labelled dataset into shards for sequential reading.
+
+    balance_dataset(df: pd.DataFrame, col_name: str, max_samples: int, num_bins: int, ...) -> pd.DataFrame:
         Balances the dataset by limiting the number of samples in each bin of a specified column.
+
+    balance_csv(input_csv: str, output_csv: str, col_name: str, max_samples: int, num_bins: int, ...) -> np.ndarray:
+        Balances a label CSV file in chunks with bounded memory, for tables larger than RAM.
 """
 
+import os
 import cv2
 import glob
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
-from sklearn.utils import shuffle
-from etrobocon.utils import steer_by_camera
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from etrobocon.utils import steer_by_camera, iter_video_frames
+from .dataset import crop_frame
+from .shard import ShardWriter
+
+
+def _line_distance(roi_frame: np.ndarray) -> float:
+    """Distance between the ROI center and the line centroid in x coordinates, NaN without a line."""
+    try:
+        mx, _, _ = steer_by_camera(roi=roi_frame)
+    except ValueError:  # No contour, the line is lost in this frame
+        return np.nan
+
+    return mx - (roi_frame.shape[1] / 2)
+
+
+def _label_frames(
+    file_stats: list[tuple[str, int, int]], roi: tuple[int, int, int, int]
+) -> list[dict]:
+    """Label a chunk of frame files, executed in a worker process of `label_dataset`."""
+    x1, y1, x2, y2 = roi
+
+    data = list()
+    for file_path, size, mtime_ns in file_stats:
+        frame = cv2.imread(file_path)
+        gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        roi_frame = gray_frame[y1:y2, x1:x2]
+        data.append(
+            {
+                "file_path": file_path,
+                "size": size,
+                "mtime_ns": mtime_ns,
+                "distance": _line_distance(roi_frame),
+            }
+        )
+
+    return data
 
 
 def label_dataset(
-    path_pattern: str, output_csv: str, roi: tuple[int, int, int, int]
+    path_pattern: str,
+    output_csv: str,
+    roi: tuple[int, int, int, int],
+    manifest_csv: str | None = None,
+    num_workers: int | None = None,
+    chunk_size: int = 256,
 ) -> pd.DataFrame:
     """
     Labels all the frame files in the provided path pattern and saves the 'frame-distance' pairs to a CSV file.
 
+    The frames are labelled in chunks by a pool of worker processes. Every finished chunk is appended to
+    a manifest keyed by file path, size and modification time, so an interrupted run can be resumed and a
+    rerun only labels the frames which are new or have changed since they were labelled.
+
     Args:
         path_pattern (str): Pathname pattern such as "./frames/*.png".
         output_csv (str): Path to the output CSV file.
+        roi (tuple[int, int, int, int]): Region of interest (x1, y1, x2, y2) passed to the line follower.
+        manifest_csv (str, optional): Path to the manifest CSV file. Defaults to "<output_csv>_manifest.csv".
+        num_workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        chunk_size (int): Number of frames labelled by a worker at a time.
 
     Returns:
         pd.DataFrame: DataFrame containing pairs of frame file paths and their corresponding distances.
+            Frames without a detectable line are left out (they are kept in the manifest with a NaN
+            distance, so they are not labelled again).
 
     Note:
         Read the csv file to DataFrame by `df = pd.read_csv('./label.csv')`
     """
+    if manifest_csv is None:
+        manifest_csv = f"{os.path.splitext(output_csv)[0]}_manifest.csv"
 
-    x1, y1, x2, y2 = roi
+    # Get list of all file paths matching the pattern together with their size and mtime
+    file_stats = list()
+    for file_path in sorted(glob.glob(path_pattern)):
+        stat = os.stat(file_path)
+        file_stats.append((file_path, stat.st_size, stat.st_mtime_ns))
 
-    # Get list of all file paths matching the pattern
-    file_paths = glob.glob(path_pattern)
-    data = list()
+    # Skip the frames already labelled with the same size and mtime
+    if os.path.exists(manifest_csv):
+        manifest = pd.read_csv(manifest_csv).drop_duplicates("file_path", keep="last")
+        labelled = set(
+            zip(manifest["file_path"], manifest["size"], manifest["mtime_ns"])
+        )
+    else:
+        labelled = set()
+    pending = [file_stat for file_stat in file_stats if file_stat not in labelled]
 
-    # Process each file
-    for file_path in tqdm(file_paths):
-        frame = cv2.imread(file_path)
-        gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        roi = gray_frame[y1:y2, x1:x2]
-        distance, _ = steer_by_camera(roi=roi)
-        data.append({"file_path": file_path, "distance": distance})
+    chunks = [pending[i : i + chunk_size] for i in range(0, len(pending), chunk_size)]
+
+    # Process each chunk, appending the results to the manifest as soon as they are available
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(_label_frames, chunk, roi) for chunk in chunks]
+
+        with tqdm(total=len(pending)) as progress_bar:
+            for future in as_completed(futures):
+                data = future.result()
+                pd.DataFrame(data).to_csv(
+                    manifest_csv,
+                    mode="a",
+                    header=not os.path.exists(manifest_csv),
+                    index=False,
+                )
+                progress_bar.update(len(data))
 
-    # Create DataFrame from collected data
-    df = pd.DataFrame(data)
+    # Create DataFrame from the manifest, keeping only the frames which still exist
+    if os.path.exists(manifest_csv):
+        manifest = pd.read_csv(manifest_csv).drop_duplicates("file_path", keep="last")
+        manifest = manifest.set_index(["file_path", "size", "mtime_ns"])
+        df = manifest.reindex(file_stats).reset_index()[["file_path", "distance"]]
+        df = df.dropna(subset=["distance"]).reset_index(drop=True)
+    else:  # No frame matched and nothing was labelled before
+        df = pd.DataFrame(columns=["file_path", "distance"])
 
     # Save DataFrame to CSV
     df.to_csv(output_csv, index=False)
@@ -58,45 +146,240 @@ def label_dataset(
     return df
 
 
+def label_video(
+    video_path: str,
+    shard_path: str,
+    roi: tuple[int, int, int, int],
+    stride: int = 1,
+    chunk_size: int = 64,
+) -> pd.DataFrame:
+    """
+    Labels the frames of a recorded video and packs them into a shard, without writing per-frame images.
+
+    The video is decoded once and its frames are labelled chunk by chunk. Only the ROI crops used by
+    `DrivingRecordDataset` are stored in the shard, together with their labels.
+
+    Args:
+        video_path (str): Path to the video, e.g. "storage/20240601120000_picamera.avi".
+        shard_path (str): Path of the output shard without extension.
+        roi (tuple[int, int, int, int]): Region of interest (x1, y1, x2, y2) passed to the line follower.
+        stride (int): Label every `stride`-th frame only.
+        chunk_size (int): Number of frames decoded at a time.
+
+    Returns:
+        pd.DataFrame: DataFrame containing the frame numbers and their corresponding distances. Frames
+            without a detectable line are skipped and are not in the shard either.
+    """
+    x1, y1, x2, y2 = roi
+
+    data = list()
+    with ShardWriter(shard_path) as writer:
+        for frame_numbers, frames in tqdm(
+            iter_video_frames(video_path, chunk_size, stride), desc=video_path
+        ):
+            for frame_number, frame in zip(frame_numbers, frames):
+                gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                distance = _line_distance(gray_frame[y1:y2, x1:x2])
+                if np.isnan(distance):
+                    continue
+
+                writer.write(
+                    crop_frame(frame), distance, source=f"{video_path}:{frame_number}"
+                )
+                data.append({"frame": frame_number, "distance": distance})
+
+    return pd.DataFrame(data)
+
+
+def write_shards(
+    df: pd.DataFrame,
+    output_dir: str,
+    shard_size: int = 4096,
+    encoding: str = "raw",
+) -> list[str]:
+    """
+    Packs the frames of a labelled dataset into shards.
+
+    Args:
+        df (pd.DataFrame): Output of `label_dataset` or `balance_dataset` with the columns "file_path"
+            and "distance".
+        output_dir (str): Directory for the shards, created if it does not exist.
+        shard_size (int): Maximum number of frames per shard.
+        encoding (str): Frame encoding of the shards, "raw" or "jpeg".
+
+    Returns:
+        list[str]: Paths of the written shards (without extension).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    shard_paths = list()
+    for start in tqdm(range(0, len(df), shard_size)):
+        shard_path = os.path.join(output_dir, f"shard-{start // shard_size:05d}")
+
+        with ShardWriter(shard_path, encoding=encoding) as writer:
+            rows = df.iloc[start : start + shard_size]
+            for file_path, distance in zip(rows["file_path"], rows["distance"]):
+                frame = cv2.imread(file_path)
+                writer.write(crop_frame(frame), distance, source=file_path)
+
+        shard_paths.append(shard_path)
+
+    return shard_paths
+
+
+def _assign_bins(values: np.ndarray, bin_edges: np.ndarray) -> np.ndarray:
+    """
+    Assign every value to exactly one bin with the same convention as `np.histogram`: the bins are
+    half-open `[left, right)` except for the last one, which also includes its right edge.
+    """
+    return np.digitize(values, bin_edges[1:-1], right=False)
+
+
 def balance_dataset(
-    df: pd.DataFrame, col_name: str, max_samples: int, num_bins: int
+    df: pd.DataFrame,
+    col_name: str,
+    max_samples: int,
+    num_bins: int,
+    random_state: int | None = None,
 ) -> pd.DataFrame:
     """
     Balances the dataset by limiting the number of samples in each bin of a specified column.
 
     This function creates a histogram of the specified column and ensures that no bin has more than
     `max_samples` samples. If a bin exceeds this limit, excess samples are randomly removed to balance
-    the dataset.
+    the dataset. Every row is assigned to exactly one bin in a single vectorized pass, and the result
+    is deterministic for a given `random_state`.
 
     Args:
         df (pd.DataFrame): The input DataFrame containing the data to be balanced.
         col_name (str): The name of the column to be used for creating bins.
         max_samples (int): The maximum number of samples allowed per bin.
         num_bins (int): The number of bins to divide the column into.
+        random_state (int, optional): Seed of the random sampling within the bins.
 
     Returns:
         pd.DataFrame: A DataFrame with the dataset balanced according to the specified column and bin limits.
     """
+    values = df[col_name].to_numpy()
+    bin_edges = np.histogram_bin_edges(values, num_bins)
+    bin_ids = _assign_bins(values, bin_edges)
 
-    hist, bins = np.histogram(df[col_name], num_bins)
+    # Visit the rows in random order and keep the first `max_samples` rows of every bin
+    rng = np.random.default_rng(random_state)
+    order = rng.permutation(len(df))
+    rank = pd.Series(bin_ids[order]).groupby(bin_ids[order]).cumcount().to_numpy()
 
-    # Initialize an empty list to store indices to remove
-    remove_list = list()
+    keep = np.zeros(len(df), dtype=bool)
+    keep[order] = rank < max_samples
 
-    # Iterate over each bin
-    for i in range(num_bins):
-        # Get the indices of the samples in the current bin
-        bin_indices = df[
-            (df[col_name] >= bins[i]) & (df[col_name] <= bins[i + 1])
-        ].index.tolist()
+    return df[keep]
 
-        # Shuffle the indices
-        bin_indices = shuffle(bin_indices)
 
-        # If the number of samples in the bin exceeds the limit, add the excess to the remove list
-        if len(bin_indices) > max_samples:
-            remove_list.extend(bin_indices[max_samples:])
+def balance_csv(
+    input_csv: str,
+    output_csv: str,
+    col_name: str,
+    max_samples: int,
+    num_bins: int,
+    chunk_size: int = 100_000,
+    random_state: int | None = None,
+) -> np.ndarray:
+    """
+    Out-of-core version of `balance_dataset` for label tables which do not fit in memory.
 
-    # Drop the rows from the DataFrame
-    df = df.drop(remove_list)
-    return df
+    The input CSV is read in chunks twice. The first pass computes the histogram bin edges of the
+    specified column, the second pass keeps at most `max_samples` rows per bin by reservoir sampling.
+    Memory use is bounded by `num_bins * max_samples` rows regardless of the size of the input. The
+    kept rows are written to the output CSV in their original order, one chunk at a time.
+
+    Args:
+        input_csv (str): Path to the input CSV file, e.g. the output of `label_dataset`.
+        output_csv (str): Path to the balanced output CSV file.
+        col_name (str): The name of the column to be used for creating bins.
+        max_samples (int): The maximum number of samples allowed per bin.
+        num_bins (int): The number of bins to divide the column into.
+        chunk_size (int): Number of rows read from the input CSV at a time.
+        random_state (int, optional): Seed of the reservoir sampling.
+
+    Returns:
+        np.ndarray: The number of rows per bin in the balanced output.
+    """
+    try:
+        header = pd.read_csv(input_csv, nrows=0)
+    except pd.errors.EmptyDataError:  # Not even a header
+        header = None
+
+    # First pass: histogram bin edges from the range of the column
+    low, high, num_rows = np.inf, -np.inf, 0
+    if header is not None:
+        for chunk in pd.read_csv(input_csv, usecols=[col_name], chunksize=chunk_size):
+            low = min(low, chunk[col_name].min())
+            high = max(high, chunk[col_name].max())
+            num_rows += len(chunk)
+    if num_rows == 0:
+        # No bins without a range, the output only gets the header
+        if header is None:
+            header = pd.DataFrame(columns=[col_name])
+        header.to_csv(output_csv, index=False)
+        return np.zeros(num_bins, dtype=np.int64)
+    bin_edges = np.histogram_bin_edges([], num_bins, range=(low, high))
+
+    # Second pass: per-bin reservoir sampling (Algorithm R), vectorized over the rows of a chunk
+    rng = np.random.default_rng(random_state)
+    seen = np.zeros(num_bins, dtype=np.int64)
+    reservoirs = dict()  # Bin -> column -> array of `max_samples` values
+    columns = None
+    row_offset = 0
+
+    for chunk in pd.read_csv(input_csv, chunksize=chunk_size):
+        columns = chunk.columns
+        chunk = chunk.assign(_row=np.arange(row_offset, row_offset + len(chunk)))
+        row_offset += len(chunk)
+
+        bin_ids = _assign_bins(chunk[col_name].to_numpy(), bin_edges)
+
+        for bin_id in np.unique(bin_ids):
+            rows = chunk[bin_ids == bin_id]
+            # 1-based position of every row among all rows of the bin seen so far
+            positions = seen[bin_id] + np.arange(1, len(rows) + 1)
+            seen[bin_id] += len(rows)
+
+            # Fill the reservoir first, then replace a random slot with probability `max_samples / position`
+            slots = np.where(
+                positions <= max_samples,
+                positions - 1,
+                rng.integers(0, positions),
+            )
+            selected = np.flatnonzero(slots < max_samples)
+
+            # Only the last row written to a slot survives
+            slots, last = np.unique(slots[selected][::-1], return_index=True)
+            selected = selected[::-1][last]
+
+            if bin_id not in reservoirs:
+                reservoirs[bin_id] = {
+                    col: np.empty(max_samples, dtype=rows[col].to_numpy().dtype)
+                    for col in rows.columns
+                }
+            for col in rows.columns:
+                reservoirs[bin_id][col][slots] = rows[col].to_numpy()[selected]
+
+    # Write the kept rows in their original order
+    kept = [
+        pd.DataFrame(
+            {
+                col: values[: min(seen[bin_id], max_samples)]
+                for col, values in reservoir.items()
+            }
+        )
+        for bin_id, reservoir in reservoirs.items()
+    ]
+    pd.DataFrame(columns=columns).to_csv(output_csv, index=False)
+    if kept:
+        df = pd.concat(kept).sort_values("_row")
+        for i in range(0, len(df), chunk_size):
+            df.iloc[i : i + chunk_size][columns].to_csv(
+                output_csv, mode="a", header=False, index=False
+            )
+
+    return np.minimum(seen, max_samples)
@@ -0,0 +1,160 @@
+"""Packed shard format for frames and steering labels
+
+A shard stores many frames in one large sequential file instead of one small image file per frame.
+Every shard consists of two files:
+
+    <name>.bin: The encoded frames, written back to back.
+    <name>.idx.npz: The random-access index with the byte offset, byte length, steering label and
+        source (file path or "video:frame") of every frame, and the encoding and shape of the frames.
+"""
+
+import cv2
+import numpy as np
+
+
+class ShardWriter:
+    """
+    Writes frames and their steering labels sequentially into a shard.
+
+    Example:
+        with ShardWriter("storage/shards/drive-0000") as writer:
+            writer.write(frame, distance, source="frame0.png")
+    """
+
+    ENCODINGS = ("raw", "jpeg")
+
+    def __init__(self, path: str, encoding: str = "raw", jpeg_quality: int = 95):
+        """
+        Args:
+            path (str): Path of the shard without extension.
+            encoding (str): Frame encoding, "raw" stores the uint8 pixels as they are and "jpeg"
+                compresses every frame with `cv2.imencode`.
+            jpeg_quality (int): JPEG quality (0-100), only used by the "jpeg" encoding.
+        """
+        if encoding not in self.ENCODINGS:
+            raise ValueError(f"Unknown shard encoding '{encoding}'")
+
+        self.path = path
+        self.encoding = encoding
+        self.jpeg_quality = jpeg_quality
+        self.shape = None
+
+        self._file = open(f"{path}.bin", "wb")
+        self._offset = 0
+        self._offsets = list()
+        self._lengths = list()
+        self._labels = list()
+        self._sources = list()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _encode(self, image: np.ndarray) -> bytes:
+        if self.encoding == "jpeg":
+            _, buffer = cv2.imencode(
+                ".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+            )
+            return buffer.tobytes()
+
+        return np.ascontiguousarray(image).tobytes()
+
+    def write(self, image: np.ndarray, label: float, source: str = "") -> None:
+        """
+        Append a frame and its label to the shard.
+
+        Args:
+            image (np.ndarray): uint8 frame, all frames of a shard must have the same shape.
+            label (float): Steering label of the frame.
+            source (str): Where the frame comes from, e.g. its file path.
+        """
+        if self.shape is None:
+            self.shape = image.shape
+        elif image.shape != self.shape:
+            raise ValueError(
+                f"Frame shape {image.shape} does not match the shard shape {self.shape}"
+            )
+
+        data = self._encode(image)
+        self._file.write(data)
+
+        self._offsets.append(self._offset)
+        self._lengths.append(len(data))
+        self._labels.append(label)
+        self._sources.append(source)
+        self._offset += len(data)
+
+    def close(self) -> None:
+        """Close the data file and write the index."""
+        if self._file.closed:
+            return
+        self._file.close()
+
+        np.savez(
+            f"{self.path}.idx.npz",
+            offsets=np.array(self._offsets, dtype=np.uint64),
+            lengths=np.array(self._lengths, dtype=np.uint32),
+            labels=np.array(self._labels, dtype=np.float32),
+            sources=np.array(self._sources, dtype=str),
+            shape=np.array(self.shape or (), dtype=np.int64),
+            encoding=np.array(self.encoding),
+        )
+
+
+class ShardReader:
+    """
+    Random access to the frames and labels of a shard.
+
+    Attributes:
+        labels (np.ndarray): Steering labels of all frames.
+        sources (np.ndarray): Sources of all frames.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): Path of the shard without extension.
+        """
+        self.path = path
+
+        with np.load(f"{path}.idx.npz") as index:
+            self.offsets = index["offsets"]
+            self.lengths = index["lengths"]
+            self.labels = index["labels"]
+            self.sources = index["sources"]
+            self.shape = tuple(index["shape"])
+            self.encoding = str(index["encoding"])
+
+        self._data = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, idx: int) -> tuple[np.ndarray, float]:
+        offset, length = int(self.offsets[idx]), int(self.lengths[idx])
+        data = self.data[offset : offset + length]
+
+        if self.encoding == "jpeg":
+            image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        else:
+            image = data.reshape(self.shape)
+
+        return image, float(self.labels[idx])
+
+    def __getstate__(self):
+        # The memory map is reopened lazily, e.g. by each `DataLoader` worker
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    @property
+    def data(self) -> np.ndarray:
+        """The read-only memory-mapped data file."""
+        if self._data is None:
+            self._data = np.memmap(f"{self.path}.bin", dtype=np.uint8, mode="r")
+        return self._data
@@ -0,0 +1,91 @@
+"""CPU training and inference acceleration
+
+Helpers for the channels_last memory format, bf16 autocast, `torch.compile` and the thread limits of
+worker processes.
+"""
+
+import contextlib
+import cv2
+import torch
+import torch.nn as nn
+
+
+def bf16_supported(device: torch.device) -> bool:
+    """
+    Check whether bf16 autocast is worthwhile on the device.
+
+    On CPU this requires oneDNN with native bf16 instructions (AVX512-BF16 or AMX), otherwise bf16 is
+    emulated and slower than fp32.
+    """
+    if device.type == "cuda":
+        return torch.cuda.is_bf16_supported()
+
+    try:
+        return torch.backends.mkldnn.is_available() and bool(
+            torch.ops.mkldnn._is_mkldnn_bf16_supported()
+        )
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def optimize_model(
+    model: nn.Module, channels_last: bool = False, compile: bool = False
+) -> nn.Module:
+    """
+    Prepare a model for faster execution.
+
+    Args:
+        model (nn.Module): The model, already moved to its device.
+        channels_last (bool): Convert the parameters to the channels_last (NHWC) memory format.
+        compile (bool): Wrap the model with `torch.compile`.
+
+    Returns:
+        nn.Module: The model to call. With `compile` this is a wrapper sharing the parameters of
+        `model`, save the `state_dict` of the original model.
+    """
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    if compile:
+        model = torch.compile(model)
+
+    return model
+
+
+def to_device(
+    inputs: torch.Tensor, device: torch.device, channels_last: bool = False
+) -> torch.Tensor:
+    """Move a batch of images to the device, in the channels_last memory format if requested."""
+    inputs = inputs.to(device, non_blocking=True)
+    if channels_last:
+        inputs = inputs.contiguous(memory_format=torch.channels_last)
+
+    return inputs
+
+
+def autocast(device: torch.device, bf16: bool = False):
+    """Context manager running the enclosed forward pass in bf16 if requested."""
+    if not bf16:
+        return contextlib.nullcontext()
+
+    return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+
+
+def limit_threads(num_threads: int, interop_threads: int | None = None) -> None:
+    """
+    Limit the threads of torch and OpenCV in the current process, e.g. in the initializer of a process
+    pool so that parallel workers do not oversubscribe the CPU.
+
+    `OMP_NUM_THREADS` is only read when torch is loaded, so setting it in a worker which has already
+    imported torch has no effect. The OpenMP pool is sized by `torch.set_num_threads` instead.
+
+    Args:
+        num_threads (int): Intra-op threads of torch and threads of OpenCV.
+        interop_threads (int, optional): Inter-op threads of torch, unchanged if not given.
+    """
+    torch.set_num_threads(num_threads)
+    cv2.setNumThreads(num_threads)
+    if interop_threads is not None:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:  # Already set, e.g. in a forked process
+            pass
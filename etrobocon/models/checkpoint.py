@@ -0,0 +1,135 @@
+"""Training checkpoints
+
+A checkpoint holds everything needed to continue a training run exactly where it stopped: the model
+and optimizer state, the epoch, the best validation loss so far and the state of all random number
+generators. Checkpoints are serialized on a background thread so that the training loop does not stall
+on disk writes.
+"""
+
+import os
+import copy
+import queue
+import random
+import threading
+import numpy as np
+import torch
+
+
+def capture_rng_state() -> dict:
+    """Returns the state of the `random`, `numpy` and `torch` (CPU and CUDA) generators."""
+    state = {
+        "random": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+
+    return state
+
+
+def restore_rng_state(state: dict) -> None:
+    """Restores the generator states returned by `capture_rng_state`."""
+    random.setstate(state["random"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def _snapshot(obj):
+    """Deep copy of a (nested) state with all tensors copied to the CPU."""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {key: _snapshot(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_snapshot(value) for value in obj)
+
+    return copy.deepcopy(obj)
+
+
+class CheckpointWriter:
+    """
+    Writes checkpoints asynchronously on a background thread.
+
+    `save` takes a snapshot of the state on the calling thread, which is fast compared to the
+    serialization, and returns while the snapshot is written to disk. Every file is written to a
+    temporary path first and then renamed, so a crash never leaves a truncated checkpoint behind.
+
+    Example:
+        writer = CheckpointWriter()
+        writer.save({"model": model.state_dict(), "epoch": epoch}, "storage/checkpoints/last.pth")
+        writer.close()
+    """
+
+    def __init__(self, max_pending: int = 2):
+        """
+        Args:
+            max_pending (int): Maximum number of snapshots waiting to be written, `save` blocks when
+                the writer falls this far behind.
+        """
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self.__write_loop, daemon=True)
+        self._thread.start()
+
+    def __write_loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+
+            state, path = item
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                torch.save(state, f"{path}.tmp")
+                os.replace(f"{path}.tmp", path)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Writing a checkpoint failed") from error
+
+    def save(self, state: dict, path: str) -> None:
+        """
+        Schedule a checkpoint to be written.
+
+        Args:
+            state (dict): The checkpoint, e.g. containing `state_dict`s. A snapshot is taken before
+                returning, so training may continue to modify the original objects.
+            path (str): Destination file path.
+        """
+        self._raise_error()
+        self._queue.put((_snapshot(state), path))
+
+    def wait(self) -> None:
+        """Block until all scheduled checkpoints have been written."""
+        self._queue.join()
+        self._raise_error()
+
+    def close(self) -> None:
+        """Write the remaining checkpoints and stop the background thread."""
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
+
+
+def load_checkpoint(path: str, map_location="cpu") -> dict:
+    """
+    Load a checkpoint written by `CheckpointWriter`.
+
+    Args:
+        path (str): Checkpoint file path.
+        map_location: Device to load the tensors to.
+
+    Returns:
+        dict: The checkpoint.
+    """
+    # The checkpoint contains the numpy and random generator states, not only tensors
+    return torch.load(path, map_location=map_location, weights_only=False)
@@ -0,0 +1,304 @@
+"""On-robot inference of the NvidiaModel
+
+Export of a trained model to TorchScript or ONNX, optional post-training int8 quantization calibrated
+on our own frames, and `SteeringPredictor`, which loads an exported model on the Raspberry Pi and
+returns the steering value (the distance between the ROI center and the line) of a camera frame.
+
+The ONNX runtime (`onnxruntime`) is only needed for ONNX models and is imported on demand.
+"""
+
+import os
+import cv2
+import time
+import platform
+import numpy as np
+import torch
+import torch.nn as nn
+from etrobocon.utils import crop_frame, PIXEL_SCALE
+
+INPUT_SHAPE = (3, 66, 200)
+
+
+def default_quantization_engine() -> str:
+    """`qnnpack` on ARM (Raspberry Pi), `x86` otherwise."""
+    if platform.machine().lower() in ("aarch64", "arm64", "armv7l"):
+        return "qnnpack"
+    if "x86" in torch.backends.quantized.supported_engines:
+        return "x86"
+
+    return "fbgemm"
+
+
+def quantize_model(
+    model: nn.Module, calibration_images: torch.Tensor, engine: str | None = None
+) -> nn.Module:
+    """
+    Post-training static int8 quantization (FX graph mode).
+
+    Args:
+        model (nn.Module): The trained float model.
+        calibration_images (torch.Tensor): Representative inputs of shape (N, 3, 66, 200) scaled to
+            [0, 1], e.g. from `load_tensor_dataset`, used to calibrate the activation ranges.
+        engine (str, optional): Quantized engine of the target, defaults to `default_quantization_engine`.
+
+    Returns:
+        nn.Module: The quantized model.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    engine = engine or default_quantization_engine()
+    torch.backends.quantized.engine = engine
+
+    model = model.eval().cpu()
+    example_inputs = (calibration_images[:1],)
+    prepared = prepare_fx(model, get_default_qconfig_mapping(engine), example_inputs)
+
+    with torch.inference_mode():
+        for start in range(0, len(calibration_images), 64):
+            prepared(calibration_images[start : start + 64])
+
+    return convert_fx(prepared)
+
+
+def export_torchscript(model: nn.Module, path: str) -> None:
+    """
+    Export a (float or quantized) model to a frozen TorchScript file.
+
+    Args:
+        model (nn.Module): The model to export.
+        path (str): Output path, e.g. "storage/model.pt".
+    """
+    model = model.eval().cpu()
+    example_input = torch.rand(1, *INPUT_SHAPE)
+
+    with torch.inference_mode():
+        scripted = torch.jit.freeze(torch.jit.trace(model, example_input))
+    torch.jit.save(scripted, path)
+
+
+def export_onnx(model: nn.Module, path: str) -> None:
+    """
+    Export a float model to ONNX with a dynamic batch dimension.
+
+    Args:
+        model (nn.Module): The model to export.
+        path (str): Output path, e.g. "storage/model.onnx".
+    """
+    model = model.eval().cpu()
+    example_input = torch.rand(1, *INPUT_SHAPE)
+
+    torch.onnx.export(
+        model,
+        (example_input,),
+        path,
+        input_names=["input"],
+        output_names=["steering"],
+        dynamic_axes={"input": {0: "batch"}, "steering": {0: "batch"}},
+    )
+
+
+class FramePreprocessor:
+    """
+    Allocation-free preprocessing of live camera frames.
+
+    Runs the same steps as `preprocess_frame` followed by the scaling to [0, 1] of
+    `DrivingRecordDataset`, with bit-identical results, but writes every intermediate result into
+    buffers allocated once at construction (OpenCV `dst=` outputs and a lookup table for the scaling).
+    The float32 model input is written into one reused tensor, which is pinned if CUDA is available.
+
+    The returned input is overwritten by the next call, so it has to be consumed (or copied) first.
+
+    Example:
+        preprocessor = FramePreprocessor()
+        inputs = preprocessor(frame)  # (1, 3, 66, 200) float32
+    """
+
+    def __init__(self, frame_shape: tuple[int, int, int] = (480, 640, 3)):
+        """
+        Args:
+            frame_shape (tuple[int, int, int]): Shape of the camera frames.
+        """
+        self.frame_shape = tuple(frame_shape)
+        roi_shape = crop_frame(np.empty(frame_shape, dtype=np.uint8)).shape
+        channels, height, width = INPUT_SHAPE
+
+        self._yuv = np.empty(roi_shape, dtype=np.uint8)
+        self._blurred = np.empty(roi_shape, dtype=np.uint8)
+        self._resized = np.empty((height, width, channels), dtype=np.uint8)
+        self._planar = np.empty(INPUT_SHAPE, dtype=np.uint8)
+        self._planes = [self._planar[i] for i in range(channels)]
+
+        self.tensor = torch.empty(
+            (1, *INPUT_SHAPE), dtype=torch.float32, pin_memory=torch.cuda.is_available()
+        )
+        # Shares the memory of `tensor`
+        self.array = self.tensor.numpy()
+
+    def __call__(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Preprocess a camera frame into `array` (and `tensor`).
+
+        Args:
+            frame (np.ndarray): BGR camera frame of shape `frame_shape`.
+
+        Returns:
+            np.ndarray: `array`, the float32 model input of shape (1, 3, 66, 200).
+        """
+        if frame.shape != self.frame_shape:
+            raise ValueError(
+                f"Expected a frame of shape {self.frame_shape}, got {frame.shape}"
+            )
+
+        channels, height, width = INPUT_SHAPE
+        cv2.cvtColor(crop_frame(frame), cv2.COLOR_RGB2YUV, dst=self._yuv)
+        cv2.GaussianBlur(self._yuv, (3, 3), 0, dst=self._blurred)
+        cv2.resize(self._blurred, (width, height), dst=self._resized)
+
+        # HWC to CHW on uint8 (split into the planes, ~10x faster than copying the transpose), then
+        # scale in one pass into the input tensor
+        cv2.split(self._resized, self._planes)
+        cv2.LUT(
+            self._planar.reshape(channels * height, width),
+            PIXEL_SCALE,
+            dst=self.array.reshape(channels * height, width),
+        )
+
+        return self.array
+
+
+class SteeringPredictor:
+    """
+    Predicts the steering value of camera frames with an exported NvidiaModel.
+
+    The model is loaded and warmed up at construction, so the first frames of a run are not slower
+    than the following ones.
+
+    Example:
+        predictor = SteeringPredictor("storage/model_int8.pt")
+        distance = predictor.predict(frame)
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        num_threads: int | None = None,
+        warmup: int = 10,
+        engine: str | None = None,
+    ):
+        """
+        Args:
+            model_path (str): TorchScript (.pt), ONNX (.onnx) or state_dict / checkpoint (.pth)
+                model file.
+            num_threads (int, optional): Number of inference threads, defaults to the runtime default.
+            warmup (int): Number of inferences run at load time.
+            engine (str, optional): Quantized engine for int8 TorchScript models.
+        """
+        self.model_path = model_path
+        self.preprocessor = None
+        self.backend = os.path.splitext(model_path)[1].lstrip(".")
+
+        if self.backend == "onnx":
+            import onnxruntime as ort
+
+            options = ort.SessionOptions()
+            if num_threads is not None:
+                options.intra_op_num_threads = num_threads
+            self._session = ort.InferenceSession(
+                model_path, options, providers=["CPUExecutionProvider"]
+            )
+            self._input_name = self._session.get_inputs()[0].name
+        else:
+            if num_threads is not None:
+                torch.set_num_threads(num_threads)
+            torch.backends.quantized.engine = engine or default_quantization_engine()
+
+            if self.backend == "pth":
+                from .nvidia import NvidiaModel
+                from .checkpoint import load_checkpoint
+
+                state = load_checkpoint(model_path)
+                self._model = NvidiaModel.from_state_dict(state.get("model", state))
+            else:
+                self._model = torch.jit.load(model_path, map_location="cpu")
+            self._model.eval()
+
+        for _ in range(warmup):
+            self.predict_batch(np.zeros((1, *INPUT_SHAPE), dtype=np.float32))
+
+    def preprocess(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Same preprocessing as `DrivingRecordDataset` without augmentation.
+
+        Args:
+            frame (np.ndarray): BGR camera frame (480, 640, 3).
+
+        Returns:
+            np.ndarray: float32 model input of shape (1, 3, 66, 200), overwritten by the next call.
+        """
+        # Created for the shape of the first frame
+        if self.preprocessor is None or self.preprocessor.frame_shape != frame.shape:
+            self.preprocessor = FramePreprocessor(frame.shape)
+
+        return self.preprocessor(frame)
+
+    def predict_batch(self, inputs: np.ndarray) -> np.ndarray:
+        """
+        Run the model on preprocessed inputs.
+
+        Args:
+            inputs (np.ndarray): float32 inputs of shape (N, 3, 66, 200).
+
+        Returns:
+            np.ndarray: The steering values of shape (N,).
+        """
+        if self.backend == "onnx":
+            (outputs,) = self._session.run(None, {self._input_name: inputs})
+            return outputs[:, 0]
+
+        with torch.inference_mode():
+            outputs = self._model(torch.from_numpy(inputs))
+        return outputs[:, 0].numpy()
+
+    def predict(self, frame: np.ndarray) -> float:
+        """
+        Predict the steering value of a camera frame.
+
+        Args:
+            frame (np.ndarray): BGR camera frame (480, 640, 3).
+
+        Returns:
+            float: The predicted distance between the ROI center and the line.
+        """
+        return float(self.predict_batch(self.preprocess(frame))[0])
+
+
+def benchmark_latency(
+    predictor: SteeringPredictor, frames: list[np.ndarray], repeat: int = 1
+) -> dict[str, float]:
+    """
+    Measure the end-to-end (preprocessing and inference) CPU latency per frame.
+
+    Args:
+        predictor (SteeringPredictor): The predictor to measure.
+        frames (list[np.ndarray]): Camera frames.
+        repeat (int): Number of passes over the frames.
+
+    Returns:
+        dict[str, float]: Latency percentiles in milliseconds and the achievable FPS.
+    """
+    latencies = list()
+    for _ in range(repeat):
+        for frame in frames:
+            start = time.perf_counter()
+            predictor.predict(frame)
+            latencies.append(time.perf_counter() - start)
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "fps": float(1000 / latencies.mean()),
+    }
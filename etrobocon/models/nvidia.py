@@ -1,3 +1,4 @@
+import torch
 import torch.nn as nn
 
 
@@ -5,34 +6,160 @@ class NvidiaModel(nn.Module):
     """A end-to-end CNN model proposed by Nvidia that map raw pixels from a single
     front-facing camera directly predicts the steering angle.
 
+    The default arguments build the original architecture. Smaller (or larger) variants are built
+    with `width_mult`, which scales the number of channels and hidden features of every layer, and
+    `depth_mult`, which scales the number of unstrided 3x3 convolutions (two in the original).
+    The layer names are the same for all variants (`conv1`, ..., `fc1`, ...), so the original
+    `state_dict`s still load.
+
     Ref:
         https://arxiv.org/abs/1604.07316
     """
 
-    def __init__(self):
+    # (out_channels, kernel_size, stride) of the strided and the 3x3 convolutions
+    STRIDED_CONVS = [(24, 5, 2), (36, 5, 2), (48, 5, 2)]
+    UNSTRIDED_CONV = (64, 3, 1)
+    NUM_UNSTRIDED_CONVS = 2
+    FC_FEATURES = [100, 50, 10]
+    INPUT_SHAPE = (3, 66, 200)
+
+    def __init__(
+        self,
+        width_mult: float = 1.0,
+        depth_mult: float = 1.0,
+        input_shape: tuple[int, int, int] = INPUT_SHAPE,
+        channels: list[int] | None = None,
+        features: list[int] | None = None,
+    ):
+        """
+        Args:
+            width_mult (float): Multiplier of the channels and hidden features.
+            depth_mult (float): Multiplier of the number of 3x3 convolutions. The 3x3 convolutions
+                beyond the original two are padded to keep the feature map size.
+            input_shape (tuple[int, int, int]): Shape (C, H, W) of one input, from which the input
+                size of `fc1` is derived.
+            channels (list[int], optional): Explicit output channels of every convolution,
+                overrides `width_mult` and `depth_mult`.
+            features (list[int], optional): Explicit output features of the hidden linear layers,
+                overrides `width_mult`.
+        """
         super(NvidiaModel, self).__init__()
-        self.conv1 = nn.Conv2d(3, 24, kernel_size=5, stride=2)
-        self.conv2 = nn.Conv2d(24, 36, kernel_size=5, stride=2)
-        self.conv3 = nn.Conv2d(36, 48, kernel_size=5, stride=2)
-        self.conv4 = nn.Conv2d(48, 64, kernel_size=3)
-        self.conv5 = nn.Conv2d(64, 64, kernel_size=3)
+
+        if channels is None:
+            num_unstrided = max(0, round(self.NUM_UNSTRIDED_CONVS * depth_mult))
+            channels = [
+                _scale(out_channels, width_mult)
+                for out_channels, _, _ in self.STRIDED_CONVS
+            ]
+            channels += [_scale(self.UNSTRIDED_CONV[0], width_mult)] * num_unstrided
+        if features is None:
+            features = [
+                _scale(out_features, width_mult) for out_features in self.FC_FEATURES
+            ]
+
+        self.input_shape = tuple(input_shape)
+        self.conv_names = [f"conv{i + 1}" for i in range(len(channels))]
+        self.fc_names = [f"fc{i + 1}" for i in range(len(features) + 1)]
+
+        in_channels = input_shape[0]
+        for i, (name, out_channels) in enumerate(zip(self.conv_names, channels)):
+            if i < len(self.STRIDED_CONVS):
+                _, kernel_size, stride = self.STRIDED_CONVS[i]
+                padding = 0
+            else:
+                _, kernel_size, stride = self.UNSTRIDED_CONV
+                # The 3x3 convolutions beyond the original two keep the feature map size
+                padding = int(i >= len(self.STRIDED_CONVS) + self.NUM_UNSTRIDED_CONVS)
+            setattr(
+                self,
+                name,
+                nn.Conv2d(
+                    in_channels,
+                    out_channels,
+                    kernel_size=kernel_size,
+                    stride=stride,
+                    padding=padding,
+                ),
+            )
+            in_channels = out_channels
+
         self.flatten = nn.Flatten()
-        self.fc1 = nn.Linear(64 * 1 * 18, 100)
-        self.fc2 = nn.Linear(100, 50)
-        self.fc3 = nn.Linear(50, 10)
-        self.fc4 = nn.Linear(10, 1)
         self.elu = nn.ELU()
 
+        # The input size of fc1 (64 * 1 * 18 for the original model) follows from the input shape
+        with torch.no_grad():
+            in_features = self._forward_features(torch.zeros(1, *input_shape)).shape[1]
+
+        for name, out_features in zip(self.fc_names, features + [1]):
+            setattr(self, name, nn.Linear(in_features, out_features))
+            in_features = out_features
+
+    @classmethod
+    def from_state_dict(
+        cls, state_dict: dict, input_shape: tuple[int, int, int] = INPUT_SHAPE
+    ) -> "NvidiaModel":
+        """
+        Build the variant matching the layer shapes of `state_dict` and load it.
+
+        Args:
+            state_dict (dict): The `state_dict` of any `NvidiaModel` variant.
+            input_shape (tuple[int, int, int]): Input shape the model was trained with.
+
+        Returns:
+            NvidiaModel: The model with the weights of `state_dict`.
+        """
+        channels, features = list(), list()
+        while f"conv{len(channels) + 1}.weight" in state_dict:
+            channels.append(state_dict[f"conv{len(channels) + 1}.weight"].shape[0])
+        while f"fc{len(features) + 2}.weight" in state_dict:
+            features.append(state_dict[f"fc{len(features) + 1}.weight"].shape[0])
+
+        model = cls(input_shape=input_shape, channels=channels, features=features)
+        model.load_state_dict(state_dict)
+
+        return model
+
+    def count_macs(self) -> int:
+        """
+        Count the multiply-accumulate operations of the convolutions and linear layers for one input.
+
+        Returns:
+            int: The number of MACs of a forward pass with a batch size of 1.
+        """
+        macs = list()
+
+        def hook(module, inputs, output):
+            if isinstance(module, nn.Conv2d):
+                kernel_size = module.kernel_size[0] * module.kernel_size[1]
+                macs.append(output.numel() * module.in_channels * kernel_size)
+            else:
+                macs.append(module.in_features * module.out_features)
+
+        handles = [
+            getattr(self, name).register_forward_hook(hook)
+            for name in self.conv_names + self.fc_names
+        ]
+        with torch.no_grad():
+            self(torch.zeros(1, *self.input_shape))
+        for handle in handles:
+            handle.remove()
+
+        return sum(macs)
+
+    def _forward_features(self, x):
+        for name in self.conv_names:
+            x = self.elu(getattr(self, name)(x))
+
+        return self.flatten(x)
+
     def forward(self, x):
-        x = self.elu(self.conv1(x))
-        x = self.elu(self.conv2(x))
-        x = self.elu(self.conv3(x))
-        x = self.elu(self.conv4(x))
-        x = self.elu(self.conv5(x))
-        x = self.flatten(x)
-        x = self.elu(self.fc1(x))
-        x = self.elu(self.fc2(x))
-        x = self.elu(self.fc3(x))
-        x = self.fc4(x)
+        x = self._forward_features(x)
+        for name in self.fc_names[:-1]:
+            x = self.elu(getattr(self, name)(x))
+        x = getattr(self, self.fc_names[-1])(x)
 
         return x
+
+
+def _scale(value: int, mult: float) -> int:
+    return max(1, int(round(value * mult)))
@@ -1 +1,2 @@
-from .etrobot import ETRobot
\ No newline at end of file
+from .etrobot import ETRobot
+from .camera import Camera, CameraFrame
\ No newline at end of file
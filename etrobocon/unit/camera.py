@@ -0,0 +1,164 @@
+import time
+import threading
+from typing import Callable, NamedTuple
+import cv2
+import numpy as np
+
+
+class CameraFrame(NamedTuple):
+    """A captured frame, `time.monotonic() - timestamp` is its age."""
+
+    seq: int  # Sequence number of the frame since the camera was opened
+    timestamp: float  # `time.monotonic()` when the driver delivered the frame
+    image: np.ndarray
+    skipped: int = 0  # Frames captured since the previously read frame but never read
+
+
+class Camera(object):
+    """
+    Camera which drains the driver on its own thread and always hands out the newest frame.
+
+    `cv2.VideoCapture.read` returns the oldest frame of the driver's buffer, so a loop which falls
+    behind steers with frames which are several periods old. The grab thread of `Camera` reads every
+    frame as soon as it arrives, `read` returns the newest one and counts the frames in between as
+    skipped.
+
+    Example:
+        camera = Camera(0, fps=20, pixel_format="MJPG")
+        while True:
+            frame = camera.read()
+            if frame is None:  # Stream end
+                break
+            age = time.monotonic() - frame.timestamp
+        camera.release()
+    """
+
+    def __init__(
+        self,
+        source: int | str = 0,
+        width: int = 640,
+        height: int = 480,
+        fps: float = 20,
+        buffer_size: int = 1,
+        pixel_format: str | None = None,
+        next_buffer: Callable[[], np.ndarray] | None = None,
+        on_frame: Callable[[CameraFrame], None] | None = None,
+    ) -> None:
+        """
+        Args:
+            source (int | str): Camera index or video path of `cv2.VideoCapture`.
+            width (int): Frame width.
+            height (int): Frame height.
+            fps (float): Frame rate.
+            buffer_size (int): Frames buffered by the driver, if supported by the backend.
+            pixel_format (str, optional): Pixel format of the camera, e.g. "MJPG" or "YUYV", the
+                driver's default if not given.
+            next_buffer (Callable[[], np.ndarray], optional): Returns the array the next frame is
+                written into, e.g. `FrameBus.next_slot`. A new array is allocated for every frame
+                if not given.
+            on_frame (Callable[[CameraFrame], None], optional): Called on the grab thread with every
+                captured frame, including those skipped by `read`, e.g. for the recording.
+        """
+        self.__capture = cv2.VideoCapture(source)
+        if pixel_format is not None:
+            # The pixel format must be set before the resolution with V4L2
+            self.__capture.set(
+                cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*pixel_format)
+            )
+        self.__capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.__capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        self.__capture.set(cv2.CAP_PROP_FPS, fps)
+        self.__capture.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
+
+        # Settings the driver actually applied
+        self.width = int(self.__capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.__capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = self.__capture.get(cv2.CAP_PROP_FPS)
+
+        self.next_buffer = next_buffer
+        self.on_frame = on_frame
+        self.frame_count = 0  # Frames captured
+        self.error = None  # Exception which stopped the grab thread
+        self.skipped = 0  # Frames captured but never read
+        self.is_running = self.__capture.isOpened()
+
+        self.__latest = None
+        self.__last_read_seq = -1
+        self.__new_frame = threading.Condition()
+
+        self.__thread = threading.Thread(
+            target=self.__grab_frames, name="camera", daemon=True
+        )
+        self.__thread.start()
+
+    def __grab_frames(self) -> None:
+        """Read every frame of the driver and publish it as the newest one."""
+        try:
+            while self.is_running:
+                buffer = self.next_buffer() if self.next_buffer is not None else None
+                if not self.__capture.grab():
+                    break
+                timestamp = time.monotonic()
+                ret, image = self.__capture.retrieve(image=buffer)
+                if not ret:
+                    break
+                if buffer is not None and not np.shares_memory(image, buffer):
+                    np.copyto(buffer, image)
+                    image = buffer
+
+                frame = CameraFrame(self.frame_count, timestamp, image)
+                self.frame_count += 1
+                if self.on_frame is not None:
+                    self.on_frame(frame)
+
+                with self.__new_frame:
+                    self.__latest = frame
+                    self.__new_frame.notify_all()
+        except Exception as e:
+            # Raised by `read`, so that it is not mistaken for the end of the stream
+            self.error = e
+        finally:
+            with self.__new_frame:
+                self.is_running = False
+                self.__new_frame.notify_all()
+
+    def read(self, timeout: float | None = None) -> CameraFrame | None:
+        """
+        Returns the newest frame, waiting for a frame newer than the previously read one.
+
+        Args:
+            timeout (float, optional): Maximum time to wait in seconds, forever if not given.
+
+        Returns:
+            CameraFrame | None: The newest frame, or None if the stream ended.
+
+        Raises:
+            TimeoutError: If no new frame arrived within `timeout`.
+            RuntimeError: If the grab thread failed, e.g. `next_buffer` does not fit the frames.
+        """
+        with self.__new_frame:
+            if not self.__new_frame.wait_for(self.__has_new_frame, timeout):
+                raise TimeoutError("No new camera frame")
+            frame = self.__latest
+            if frame is None or frame.seq == self.__last_read_seq:
+                if self.error is not None:
+                    raise RuntimeError("The camera grab thread failed") from self.error
+                return None  # Stream ended
+
+            skipped = frame.seq - self.__last_read_seq - 1
+            self.skipped += skipped
+            self.__last_read_seq = frame.seq
+
+        return frame._replace(skipped=skipped)
+
+    def __has_new_frame(self) -> bool:
+        return not self.is_running or (
+            self.__latest is not None and self.__latest.seq != self.__last_read_seq
+        )
+
+    def release(self) -> None:
+        """Stop the grab thread and release the camera."""
+        self.is_running = False
+        self.__thread.join()
+        self.__capture.release()
+        self.__latest = None  # May be a view of `next_buffer`
@@ -1,10 +1,24 @@
-from .follower import steer_by_camera
+from .follower import steer_by_camera, LineFollower, ScanlineFollower, LineDetection
 
 from .image import (
     perform_edge_detection,
     extract_roi_and_resize,
+    crop_frame,
+    preprocess_frame,
+    PIXEL_SCALE,
     extract_video_frames,
+    iter_video_frames,
     draw_driving_info,
 )
 
 from .pid import PIDController
+
+from .timing import StepTimer, peak_rss_mb
+
+from .pipeline import DropOldestQueue, Stage
+
+from .framebus import FrameBus
+
+from .trace import LatencyTracer
+
+from .driving import ROI, BASE_POWER, PID_GAINS, SEARCH_WIDTH
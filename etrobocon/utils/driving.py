@@ -0,0 +1,12 @@
+"""
+Driving parameters
+
+The region of interest, motor power, PID gains and line tracking window of run.py. collector.py,
+replay.py and benchmark.py import them from here, so retuning the robot also retunes the offline
+tools.
+"""
+
+ROI = (100, 200, 540, 300)  # Region of Interest (x1, y1, x2, y2) of the camera frames
+BASE_POWER = 50  # Base motor power
+PID_GAINS = (0.1, 0.001, 0)  # Kp, Ki and Kd of the steering
+SEARCH_WIDTH = 120  # Tracking window of the line detector, None to search the full ROI
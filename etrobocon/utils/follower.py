@@ -6,6 +6,15 @@ and color sensor-based methods. These implementations are used for training data
 collection for a model. By sending input data such as a camera image or sensor status, 
 the functions return the necessary adjustments.
 
+Classes:
+    LineFollower:
+        Stateful, allocation-free counterpart of `steer_by_camera` for the live loop, which reports
+        a lost line instead of raising and can track the line in a narrow search window.
+
+    ScanlineFollower:
+        Cheap estimate of the line position from a few thresholded rows of the ROI. It returns the
+        same `LineDetection` type as `LineFollower`, the position can differ by a fraction of a pixel.
+
 Functions:
     steer_by_camera(roi: np.ndarray) -> tuple[float, dict]:
         Calculates the steering adjustment based on the difference between the 
@@ -18,7 +27,278 @@ Functions:
 """
 
 import cv2
+import time
 import numpy as np
+from typing import NamedTuple
+
+
+class LineDetection(NamedTuple):
+    """
+    Result of `LineFollower`.
+
+    Attributes:
+        mx (float): The x-coordinate of the line centroid in the ROI.
+        my (float): The y-coordinate of the line centroid in the ROI.
+        area (float): Area of the detected line in pixels, 0 if the line is lost.
+        lost (bool): Whether no line was found. `mx` and `my` are then the last detected centroid
+            (the ROI center before the first detection), so the robot keeps its course.
+    """
+
+    mx: float
+    my: float
+    area: float
+    lost: bool
+
+
+class LineFollower:
+    """
+    Detects the line in the ROI of every frame like `steer_by_camera`, without per-frame allocations
+    and without raising when there is no line.
+
+    The blur, threshold and mask buffers are allocated once for the ROI shape and reused. The two
+    3x3 erosions and dilations are merged into one opening with a 5x5 kernel, which gives the same
+    mask, and the mask is not copied before `findContours`. The detected centroid is identical to
+    the one of `steer_by_camera`. Searching the full ROI is not measurably faster than
+    `steer_by_camera` though, most of the time goes to the blur and the contour extraction, only the
+    tracking mode below searches fewer pixels. Run `python benchmark.py follower` to compare them on
+    the target.
+
+    Tracking mode (`search_width`): the line moves only a few pixels between frames, so only a
+    window of `search_width` columns centered on the previous centroid is searched. The window is
+    doubled for the next frame when the detection is not confident, i.e. the line touches the window
+    border or its area dropped below `min_area_ratio` of the previous one, and it is reset to
+    `search_width` after a confident detection. If the line is not found in the window, the full ROI
+    is searched in the same frame. Since the blur and the opening see the window border instead of
+    the neighbouring pixels, the centroid of a line close to the border can differ slightly from a
+    search of the full ROI, such a detection is not confident anyway.
+
+    Attributes:
+        window (tuple[int, int]): The columns (x1, x2) of the ROI searched in the last call.
+        cost (float): Detection time of the last call in seconds.
+
+    Example:
+        follower = LineFollower(search_width=120)
+        mx, my, area, lost = follower(roi)
+    """
+
+    def __init__(
+        self,
+        threshold: int = 100,
+        min_area: float = 0,
+        search_width: int | None = None,
+        min_area_ratio: float = 0.5,
+    ):
+        """
+        Args:
+            threshold (int): Gray value below which a pixel belongs to the (dark) line.
+            min_area (float): Blobs with a smaller area are ignored, e.g. to not follow noise.
+            search_width (int, optional): Width of the tracking window, the full ROI is searched in
+                every frame if not given.
+            min_area_ratio (float): Minimum area relative to the previous detection for a confident
+                detection in tracking mode.
+        """
+        self.threshold = threshold
+        self.min_area = min_area
+        self.search_width = search_width
+        self.min_area_ratio = min_area_ratio
+        self._kernel = np.ones((5, 5), dtype=np.uint8)
+        self._shape = None
+        self.window = None
+        self.cost = 0.0
+
+    def _allocate(self, shape: tuple[int, int]) -> None:
+        self._shape = shape
+        self._blur = np.empty(shape, dtype=np.uint8)
+        self._thresh = np.empty(shape, dtype=np.uint8)
+        self._mask = np.empty(shape, dtype=np.uint8)
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget the last detected line, e.g. before a new run."""
+        if self._shape is not None:
+            self._last = (self._shape[1] / 2, self._shape[0] / 2)
+        self._last_area = 0.0
+        self._window_width = None  # Search the full ROI first
+
+    def __call__(self, roi: np.ndarray) -> LineDetection:
+        """
+        Detect the line in a gray ROI.
+
+        Args:
+            roi (np.ndarray): The gray region of interest from the camera feed.
+
+        Returns:
+            LineDetection: The centroid and area of the largest blob, or the last centroid with
+            `lost=True` if there is none.
+        """
+        start = time.perf_counter()
+        if roi.shape != self._shape:
+            self._allocate(roi.shape)
+
+        roi_width = roi.shape[1]
+        width = self._window_width or roi_width
+        if width < roi_width:
+            x1 = min(max(int(self._last[0]) - width // 2, 0), roi_width - width)
+            x2 = x1 + width
+        else:
+            x1, x2 = 0, roi_width
+
+        centroid, area, (left, right) = self._detect(roi, x1, x2)
+        if centroid is None and (x1, x2) != (0, roi_width):
+            # Lost in the window, search the full ROI before giving up
+            x1, x2 = 0, roi_width
+            centroid, area, (left, right) = self._detect(roi, x1, x2)
+
+        if self.search_width is not None:
+            confident = (
+                centroid is not None
+                and (left > 0 or x1 == 0)
+                and (right < x2 - x1 or x2 == roi_width)
+                and area >= self.min_area_ratio * self._last_area
+            )
+            if confident:
+                self._window_width = self.search_width
+            else:
+                self._window_width = min(2 * (x2 - x1), roi_width)
+
+        self.window = (x1, x2)
+        if centroid is None:
+            detection = LineDetection(*self._last, 0.0, True)
+        else:
+            self._last, self._last_area = centroid, area
+            detection = LineDetection(*centroid, area, False)
+
+        self.cost = time.perf_counter() - start
+        return detection
+
+    def _detect(
+        self, roi: np.ndarray, x1: int, x2: int
+    ) -> tuple[tuple[float, float] | None, float, tuple[int, int]]:
+        """
+        Find the largest blob in the columns x1:x2 of the ROI.
+
+        Returns:
+            The centroid in ROI coordinates (None if there is no blob), the area and the left and
+            right border of the blob in window coordinates.
+        """
+        width = x2 - x1
+        blur, thresh, mask = (
+            buffer[:, :width] for buffer in (self._blur, self._thresh, self._mask)
+        )
+
+        cv2.GaussianBlur(roi[:, x1:x2], (5, 5), 0, dst=blur)
+        cv2.threshold(blur, self.threshold, 255, cv2.THRESH_BINARY_INV, dst=thresh)
+        # Erode to eliminate noise, Dilate to restore eroded parts of image
+        cv2.morphologyEx(thresh, cv2.MORPH_OPEN, self._kernel, dst=mask)
+
+        centroid, area, bounds = self._largest_contour(mask)
+
+        if centroid is None or area <= 0 or area < self.min_area:
+            return None, 0.0, (0, 0)
+
+        return (centroid[0] + x1, centroid[1]), area, bounds
+
+    @staticmethod
+    def _largest_contour(mask: np.ndarray):
+        contours, _ = cv2.findContours(mask, 1, cv2.CHAIN_APPROX_NONE)
+        if not contours:
+            return None, 0.0, (0, 0)
+
+        max_contour = max(contours, key=cv2.contourArea)
+
+        mu = cv2.moments(max_contour)
+        # Add 1e-5 to avoid division by zero
+        mx = mu["m10"] / (mu["m00"] + 1e-5)
+        my = mu["m01"] / (mu["m00"] + 1e-5)
+
+        x, _, w, _ = cv2.boundingRect(max_contour)
+        return (mx, my), cv2.contourArea(max_contour), (x, x + w)
+
+
+class ScanlineFollower:
+    """
+    Estimates the horizontal line position from a few rows of the ROI with NumPy reductions only.
+
+    `num_rows` evenly spaced rows are sampled (every `column_step`-th column), thresholded, and the
+    line position is the center of the dark pixels. There is no blur, morphology or contour
+    extraction, so it is much cheaper than `LineFollower`, but every dark pixel in the sampled rows
+    counts, not only the largest blob. Use `python benchmark.py follower --video ...` to compare the
+    accuracy against the contour method on recorded frames.
+
+    It returns a `LineDetection` like `LineFollower`, so both can be used interchangeably.
+
+    Attributes:
+        cost (float): Detection time of the last call in seconds.
+
+    Example:
+        follower = ScanlineFollower(num_rows=8)
+        mx, my, area, lost = follower(roi)
+    """
+
+    def __init__(
+        self,
+        num_rows: int = 8,
+        column_step: int = 2,
+        threshold: int = 100,
+        min_pixels: int = 10,
+    ):
+        """
+        Args:
+            num_rows (int): Number of sampled rows.
+            column_step (int): Sample every `column_step`-th column (horizontal downsampling).
+            threshold (int): Gray value below which a pixel belongs to the (dark) line.
+            min_pixels (int): Minimum number of dark samples, below which the line is lost.
+        """
+        self.num_rows = num_rows
+        self.column_step = column_step
+        self.threshold = threshold
+        self.min_pixels = min_pixels
+        self._shape = None
+        self.cost = 0.0
+
+    def _allocate(self, shape: tuple[int, int]) -> None:
+        self._shape = shape
+        self._rows = np.linspace(0, shape[0] - 1, self.num_rows).round().astype(np.intp)
+        self._columns = np.arange(0, shape[1], self.column_step, dtype=np.float64)
+        self._samples = np.empty((self.num_rows, shape[1]), dtype=np.uint8)
+        self._dark = np.empty((self.num_rows, len(self._columns)), dtype=bool)
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget the last detected line, e.g. before a new run."""
+        if self._shape is not None:
+            self._last = (self._shape[1] / 2, self._shape[0] / 2)
+
+    def __call__(self, roi: np.ndarray) -> LineDetection:
+        """
+        Estimate the line position in a gray ROI.
+
+        Args:
+            roi (np.ndarray): The gray region of interest from the camera feed.
+
+        Returns:
+            LineDetection: The center of the dark samples and their number, or the last position
+            with `lost=True` if there are fewer than `min_pixels`.
+        """
+        start = time.perf_counter()
+        if roi.shape != self._shape:
+            self._allocate(roi.shape)
+
+        np.take(roi, self._rows, axis=0, out=self._samples)
+        np.less(self._samples[:, :: self.column_step], self.threshold, out=self._dark)
+
+        row_counts = self._dark.sum(axis=1)
+        count = int(row_counts.sum())
+        if count < self.min_pixels:
+            detection = LineDetection(*self._last, 0.0, True)
+        else:
+            mx = float(self._dark.sum(axis=0) @ self._columns) / count
+            my = float(row_counts @ self._rows) / count
+            self._last = (mx, my)
+            detection = LineDetection(mx, my, float(count), False)
+
+        self.cost = time.perf_counter() - start
+        return detection
 
 
 def steer_by_camera(roi: np.ndarray) -> tuple[float, float, dict]:
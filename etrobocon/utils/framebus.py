@@ -0,0 +1,278 @@
+"""
+Shared-memory frame bus
+
+This module contains a ring buffer of camera frames in `multiprocessing.shared_memory`, which lets a
+capture process hand frames to control, recording and telemetry processes without pickling or copying
+them, so that the OpenCV and Python work of the stages runs on separate cores instead of contending for
+the GIL.
+
+Classes:
+    FrameBus: Ring buffer of frames with sequence numbers and capture timestamps.
+"""
+
+import os
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+# Header fields (int64) before the per-slot sequence numbers and timestamps
+_LATEST, _CLOSED, _HEADER_SIZE = 0, 1, 2
+
+
+class FrameBus:
+    """
+    Single-writer, multi-reader ring buffer of frames in shared memory.
+
+    Every written frame gets the next sequence number (0, 1, ...) and is stored in slot
+    `seq % slots`. Every slot carries its sequence number (-1 while it is being written), which lets
+    readers detect overwritten frames without locks. `read` returns a read-only view of the slot, not
+    a copy, which is overwritten `slots` frames later, so a reader must check `valid` after using the
+    view (e.g. after converting it to gray) and discard its result otherwise. `copy` and
+    `frames(copy=True)` copy the frame out of the slot and do this check.
+
+    The bus can be passed to `multiprocessing.Process` arguments, the child process attaches to the
+    same shared memory.
+
+    Example:
+        bus = FrameBus(slots=8, shape=(480, 640, 3))  # Creates the shared memory
+        seq = bus.write(frame)  # Capture process
+
+        for seq, frame in bus.frames(copy=True):  # Recording process, every frame
+            writer.write(frame)
+
+        seq, frame = bus.latest()  # Control process, only the newest frame
+
+        bus.close()  # Capture process, end of the stream
+        bus.detach()
+    """
+
+    def __init__(
+        self,
+        slots: int = 8,
+        shape: tuple[int, ...] = (480, 640, 3),
+        dtype=np.uint8,
+        name: str | None = None,
+    ):
+        """
+        Args:
+            slots (int): Number of frames kept in the ring buffer.
+            shape (tuple[int, ...]): Frame shape.
+            dtype: Frame dtype.
+            name (str, optional): Name of existing shared memory to attach to, new shared memory is
+                created if not given.
+        """
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.dropped = 0  # Frames skipped by `frames` because the reader fell behind
+
+        frame_bytes = int(np.prod(shape)) * self.dtype.itemsize
+        header_bytes = (_HEADER_SIZE + 2 * slots) * 8
+        # The creating process, a forked child inherits the object but must not release the memory
+        self._owner_pid = os.getpid() if name is None else None
+        self._shm = shared_memory.SharedMemory(
+            name=name, create=name is None, size=header_bytes + slots * frame_bytes
+        )
+        self._attach()
+
+        if name is None:
+            self._header[_LATEST] = -1
+            self._header[_CLOSED] = 0
+            self._sequences[:] = -1
+
+    def _attach(self) -> None:
+        buffer = self._shm.buf
+        self._header = np.ndarray((_HEADER_SIZE,), dtype=np.int64, buffer=buffer)
+        self._sequences = np.ndarray(
+            (self.slots,), dtype=np.int64, buffer=buffer, offset=_HEADER_SIZE * 8
+        )
+        self._timestamps = np.ndarray(
+            (self.slots,),
+            dtype=np.float64,
+            buffer=buffer,
+            offset=(_HEADER_SIZE + self.slots) * 8,
+        )
+        self._frames = np.ndarray(
+            (self.slots, *self.shape),
+            dtype=self.dtype,
+            buffer=buffer,
+            offset=(_HEADER_SIZE + 2 * self.slots) * 8,
+        )
+
+    @property
+    def name(self) -> str:
+        """Name of the shared memory."""
+        return self._shm.name
+
+    def __getstate__(self):
+        # Child processes attach to the shared memory by name
+        return {
+            "slots": self.slots,
+            "shape": self.shape,
+            "dtype": self.dtype.str,
+            "name": self.name,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    # Writer
+
+    def next_slot(self) -> np.ndarray:
+        """
+        Returns the writable slot of the next frame, e.g. as the destination of
+        `cv2.VideoCapture.read(image=...)`, which is published by `commit`.
+        """
+        seq = int(self._header[_LATEST]) + 1
+        slot = seq % self.slots
+        self._sequences[slot] = -1  # Being written
+        return self._frames[slot]
+
+    def commit(self, timestamp: float | None = None) -> int:
+        """
+        Publish the frame written into `next_slot`.
+
+        Args:
+            timestamp (float, optional): Capture time (`time.monotonic()`), defaults to now.
+
+        Returns:
+            int: The sequence number of the frame.
+        """
+        seq = int(self._header[_LATEST]) + 1
+        slot = seq % self.slots
+        self._timestamps[slot] = time.monotonic() if timestamp is None else timestamp
+        self._sequences[slot] = seq
+        self._header[_LATEST] = seq
+        return seq
+
+    def write(self, frame: np.ndarray, timestamp: float | None = None) -> int:
+        """
+        Copy a frame into the next slot and publish it.
+
+        Returns:
+            int: The sequence number of the frame.
+        """
+        np.copyto(self.next_slot(), frame)
+        return self.commit(timestamp)
+
+    def close(self) -> None:
+        """Mark the end of the stream, readers stop after the last frame."""
+        self._header[_CLOSED] = 1
+
+    # Readers
+
+    @property
+    def latest_seq(self) -> int:
+        """Sequence number of the newest frame, -1 before the first frame."""
+        return int(self._header[_LATEST])
+
+    @property
+    def closed(self) -> bool:
+        """Whether the writer has closed the bus."""
+        return bool(self._header[_CLOSED])
+
+    def valid(self, seq: int) -> bool:
+        """Whether the frame `seq` is (still) in the buffer and not being overwritten."""
+        return int(self._sequences[seq % self.slots]) == seq
+
+    def read(self, seq: int) -> np.ndarray | None:
+        """
+        Returns a read-only view of frame `seq`, or None if it was overwritten or not written yet.
+        """
+        if not self.valid(seq):
+            return None
+
+        view = self._frames[seq % self.slots]
+        view.flags.writeable = False
+        return view
+
+    def copy(self, seq: int, out: np.ndarray | None = None) -> np.ndarray | None:
+        """
+        Copy frame `seq` out of its slot.
+
+        Args:
+            seq (int): Sequence number of the frame.
+            out (np.ndarray, optional): Array the frame is copied into, a new one if not given.
+
+        Returns:
+            np.ndarray | None: The copy, or None if the frame was overwritten before or during the
+                copy.
+        """
+        frame = self.read(seq)
+        if frame is None:
+            return None
+
+        if out is None:
+            out = np.empty(self.shape, dtype=self.dtype)
+        np.copyto(out, frame)
+        # The writer marks the slot before overwriting it, so an unchanged sequence number means
+        # the copy is not torn
+        return out if self.valid(seq) else None
+
+    def timestamp(self, seq: int) -> float:
+        """Capture time (`time.monotonic()`) of frame `seq`."""
+        return float(self._timestamps[seq % self.slots])
+
+    def latest(self) -> tuple[int, np.ndarray | None]:
+        """Returns the sequence number and a view of the newest frame."""
+        seq = self.latest_seq
+        return seq, self.read(seq) if seq >= 0 else None
+
+    def wait(self, seq: int, timeout: float | None = None, poll: float = 0.001) -> bool:
+        """
+        Wait until frame `seq` has been written.
+
+        Returns:
+            bool: False if the bus was closed or the timeout expired before.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.latest_seq < seq:
+            if self.closed or (deadline is not None and time.monotonic() > deadline):
+                return False
+            time.sleep(poll)
+
+        return True
+
+    def frames(self, start: int | None = None, copy: bool = False):
+        """
+        Iterate over every frame from `start` (the next frame if not given) until the bus is closed.
+
+        Frames which were overwritten before the reader got to them are skipped and counted in
+        `dropped`.
+
+        Args:
+            start (int, optional): Sequence number of the first frame.
+            copy (bool): Copy every frame out of its slot into one reused array, and skip (and count)
+                the frames which were overwritten during the copy. Otherwise the caller gets views
+                and must check `valid` after using them.
+
+        Yields:
+            tuple[int, np.ndarray]: The sequence number and the frame, a read-only view of the slot
+                or the reused copy.
+        """
+        out = np.empty(self.shape, dtype=self.dtype) if copy else None
+        seq = self.latest_seq + 1 if start is None else start
+        while self.wait(seq) or self.latest_seq >= seq:
+            # Fell behind by more than the ring buffer. The oldest frame is the next one the writer
+            # overwrites, so continue in the middle of the ring buffer
+            if seq <= self.latest_seq - self.slots + 1:
+                resume = self.latest_seq - self.slots // 2
+                self.dropped += resume - seq
+                seq = resume
+
+            frame = self.copy(seq, out) if copy else self.read(seq)
+            if frame is None:  # Overwritten meanwhile
+                self.dropped += 1
+            else:
+                yield seq, frame
+            seq += 1
+
+    def detach(self) -> None:
+        """
+        Detach from the shared memory, the owner also releases it. The frame views returned by the bus
+        must be released before.
+        """
+        self._header = self._sequences = self._timestamps = self._frames = None
+        self._shm.close()
+        if self._owner_pid == os.getpid():
+            self._shm.unlink()
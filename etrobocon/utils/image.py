@@ -1,6 +1,11 @@
 import cv2
 import numpy as np
 
+# Float32 model input of every uint8 value of a preprocessed frame, the same values as `image / 255`
+# in float64 followed by the cast to float32. Shared by the training and the on-robot preprocessing
+PIXEL_SCALE = (np.arange(256) / 255).astype(np.float32)
+PIXEL_SCALE.flags.writeable = False
+
 
 def perform_edge_detection(image: np.ndarray) -> np.ndarray:
     """
@@ -66,6 +71,39 @@ def extract_roi_and_resize(
     return new_image
 
 
+def crop_frame(image: np.ndarray) -> np.ndarray:
+    """
+    Crop the rows of a raw camera frame which are used as the model input.
+
+    Args:
+        image (np.ndarray): Frame as read by `cv2.imread` or `cv2.VideoCapture`.
+
+    Returns:
+        np.ndarray: The ROI of the frame (a view, not a copy).
+    """
+    return image[60:135, :, :]  # ROI
+
+
+def preprocess_frame(image: np.ndarray, cropped: bool = False) -> np.ndarray:
+    """
+    Apply the fixed (non-random) preprocessing steps to a raw camera frame.
+
+    Args:
+        image (np.ndarray): Frame as read by `cv2.imread`.
+        cropped (bool): Whether `image` has already been cropped by `crop_frame`.
+
+    Returns:
+        np.ndarray: The uint8 model input of shape (66, 200, 3) before scaling.
+    """
+    if not cropped:
+        image = crop_frame(image)
+    image = cv2.cvtColor(image, cv2.COLOR_RGB2YUV)
+    image = cv2.GaussianBlur(image, (3, 3), 0)
+    image = cv2.resize(image, (200, 66))
+
+    return image
+
+
 def draw_driving_info(
     gray: np.ndarray, info: dict, roi: tuple[int, int, int, int]
 ) -> np.ndarray:
@@ -126,3 +164,44 @@ def extract_video_frames(video_path: str, frame_path: str, label: str) -> None:
         # Saves the frames with frame-count
         cv2.imwrite(f"{frame_path}{label}_frame%d.png" % count, image)
         count += 1
+
+
+def iter_video_frames(video_path: str, chunk_size: int = 64, stride: int = 1):
+    """
+    Decode a video once and yield its frames in chunks, without writing them to disk
+
+    Args:
+        video_path: Video file path
+        chunk_size: Maximum number of frames per chunk
+        stride: Keep every `stride`-th frame, the skipped frames are grabbed but not retrieved
+
+    Yields:
+        A tuple of the frame numbers and the frames of a chunk
+    """
+    cap = cv2.VideoCapture(video_path)
+
+    count = 0
+    frame_numbers, frames = list(), list()
+
+    while True:
+        if count % stride == 0:
+            success, image = cap.read()
+        else:
+            success, image = cap.grab(), None
+
+        if not success:
+            break
+
+        if image is not None:
+            frame_numbers.append(count)
+            frames.append(image)
+
+            if len(frames) == chunk_size:
+                yield frame_numbers, frames
+                frame_numbers, frames = list(), list()
+        count += 1
+
+    cap.release()
+
+    if frames:
+        yield frame_numbers, frames
@@ -44,17 +44,20 @@ class PIDController:
         self._last_error = 0.0
         self._integral = 0.0
 
-    def update(self, measured_value: float) -> int:
+    def update(self, measured_value: float, current_time: float | None = None) -> int:
         """
         Calculate the control variable based on the measured value.
 
         Args:
             measured_value (float): The current value of the process variable.
+            current_time (float, optional): Time of the measurement in seconds, e.g. the timestamp of
+                a recorded frame when replaying a run. Defaults to the current wall-clock time.
 
         Returns:
             int: Control output, typically used for wheel steering or other control mechanisms.
         """
-        current_time = time.time()
+        if current_time is None:
+            current_time = time.time()
         error = self.setpoint - measured_value
 
         delta_time = (
@@ -0,0 +1,158 @@
+"""
+Pipeline helpers
+
+This module contains the building blocks for splitting a real-time loop into stages running on their
+own threads, so that slow side stages (e.g. recording to disk or sending telemetry over the network)
+never delay the time-critical stage.
+
+Classes:
+    DropOldestQueue: Bounded queue whose `put` never blocks but drops the oldest item when full.
+    Stage: Thread which handles the items of a `DropOldestQueue` until the queue is closed.
+"""
+
+import time
+import queue
+import threading
+import collections
+
+
+class DropOldestQueue:
+    """
+    Bounded FIFO queue which drops its oldest item instead of blocking the producer when full.
+
+    A queue of size 1 always holds the latest item, e.g. the latest camera frame.
+
+    Attributes:
+        maxsize (int): Maximum number of queued items.
+        dropped (int): Number of items dropped because the consumer did not keep up.
+        put_count (int): Number of items put into the queue.
+    """
+
+    def __init__(self, maxsize: int):
+        """
+        Args:
+            maxsize (int): Maximum number of queued items.
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+
+        self.maxsize = maxsize
+        self.dropped = 0
+        self.put_count = 0
+        self._items = collections.deque(maxlen=maxsize)
+        self._closed = False
+        self._not_empty = threading.Condition()
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item) -> None:
+        """
+        Append an item, dropping the oldest one if the queue is full. Never blocks.
+
+        Args:
+            item: Any object except `None`, which marks the end of the queue for `get`.
+        """
+        with self._not_empty:
+            if self._closed:
+                return
+            if len(self._items) == self.maxsize:
+                self.dropped += 1
+            self._items.append(item)  # The deque discards the oldest item
+            self.put_count += 1
+            self._not_empty.notify()
+
+    def get(self, timeout: float | None = None):
+        """
+        Remove and return the oldest item, waiting for one if the queue is empty.
+
+        Args:
+            timeout (float, optional): Maximum time to wait in seconds, forever if not given.
+
+        Returns:
+            The oldest item, or `None` if the queue is closed and empty.
+
+        Raises:
+            queue.Empty: If no item arrived within `timeout`.
+        """
+        with self._not_empty:
+            if not self._not_empty.wait_for(
+                lambda: self._items or self._closed, timeout
+            ):
+                raise queue.Empty
+            if self._items:
+                return self._items.popleft()
+
+            return None
+
+    def close(self) -> None:
+        """Stop accepting items, the consumer still gets the queued ones before `None`."""
+        with self._not_empty:
+            self._closed = True
+            self._not_empty.notify_all()
+
+
+class Stage(threading.Thread):
+    """
+    Runs `handler` on every item of a queue on its own (daemon) thread.
+
+    An exception in `handler` is counted and the stage continues with the next item, so a failing side
+    stage (e.g. a lost network connection) does not stop the robot.
+
+    Attributes:
+        processed (int): Number of handled items.
+        errors (int): Number of items whose handler raised.
+        last_error (Exception | None): The last exception raised by the handler.
+        busy_time (float): Total time spent in `handler` in seconds.
+
+    Example:
+        frames = DropOldestQueue(32)
+        recorder = Stage("recording", frames, writer.write)
+        recorder.start()
+        frames.put(frame)
+        ...
+        frames.close()
+        recorder.join()
+    """
+
+    def __init__(self, name: str, input_queue: DropOldestQueue, handler):
+        """
+        Args:
+            name (str): Stage name, used for the thread and the statistics.
+            input_queue (DropOldestQueue): Queue of the items to handle.
+            handler (Callable): Function called with every item.
+        """
+        super().__init__(name=name, daemon=True)
+        self.input_queue = input_queue
+        self.handler = handler
+        self.processed = 0
+        self.errors = 0
+        self.last_error = None
+        self.busy_time = 0.0
+
+    def run(self) -> None:
+        while True:
+            item = self.input_queue.get()
+            if item is None:
+                break
+
+            start = time.perf_counter()
+            try:
+                self.handler(item)
+            except Exception as e:
+                self.errors += 1
+                self.last_error = e
+            self.busy_time += time.perf_counter() - start
+            self.processed += 1
+
+    def stats(self) -> dict:
+        """Returns the processed, dropped and failed item counts of the stage."""
+        return {
+            "stage": self.name,
+            "processed": self.processed,
+            "dropped": self.input_queue.dropped,
+            "errors": self.errors,
+            "busy_ms_per_item": (
+                self.busy_time * 1000 / self.processed if self.processed else 0.0
+            ),
+        }
@@ -0,0 +1,97 @@
+"""
+Timing helpers
+
+This module contains lightweight helpers for measuring where the time of a loop goes, e.g. the data
+wait, forward, backward and optimizer phases of a training step, without attaching a profiler.
+
+Classes:
+    StepTimer: Measures consecutive phases of a step with `time.perf_counter`.
+
+Functions:
+    peak_rss_mb() -> float | None:
+        Returns the peak resident set size of the current process in MiB.
+"""
+
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+class StepTimer:
+    """
+    Measures the duration of consecutive phases of a step.
+
+    Example:
+        timer = StepTimer()
+        timer.start()
+        for inputs in loader:
+            timer.lap("data")
+            outputs = model(inputs)
+            timer.lap("forward")
+
+    Attributes:
+        durations (dict[str, float]): Duration of every phase in the current step, in seconds.
+        totals (dict[str, float]): Accumulated duration of every phase since the last `reset`.
+    """
+
+    def __init__(self, sync=None):
+        """
+        Args:
+            sync (callable, optional): Called before every measurement, e.g. `torch.cuda.synchronize`
+                so that asynchronous GPU work is attributed to the right phase.
+        """
+        self.sync = sync
+        self.durations = dict()
+        self.totals = dict()
+        self._last = None
+
+    def start(self) -> None:
+        """Start (or restart) the measurement of the next phase."""
+        if self.sync is not None:
+            self.sync()
+        self._last = time.perf_counter()
+
+    def lap(self, name: str) -> float:
+        """
+        End the current phase and start the next one.
+
+        Args:
+            name (str): Name of the phase which has just ended.
+
+        Returns:
+            float: Duration of the phase in seconds.
+        """
+        if self.sync is not None:
+            self.sync()
+        now = time.perf_counter()
+        duration = now - self._last
+        self._last = now
+
+        self.durations[name] = duration
+        self.totals[name] = self.totals.get(name, 0.0) + duration
+
+        return duration
+
+    def reset(self) -> None:
+        """Clear the accumulated durations."""
+        self.durations.clear()
+        self.totals.clear()
+
+
+def peak_rss_mb() -> float | None:
+    """
+    Returns the peak resident set size (RSS) of the current process in MiB, or `None` if the platform
+    does not provide it.
+    """
+    if resource is None:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes on Linux
+    if sys.platform == "darwin":
+        return max_rss / 2**20
+    return max_rss / 2**10
@@ -0,0 +1,193 @@
+"""
+Latency tracing
+
+This module contains a per-frame tracer of the stages of a real-time loop (e.g. capture, steering,
+PID, motors and telemetry of run.py). The spans are stored in fixed-size preallocated buffers, so the
+memory of the tracer stays constant during a run, and can be summarized as percentiles or exported
+as a Chrome trace to find the frames with jitter spikes.
+
+Classes:
+    LatencyTracer: Ring buffer of the per-stage spans of the latest frames.
+"""
+
+import os
+import math
+import json
+import time
+import threading
+import numpy as np
+
+
+class LatencyTracer:
+    """
+    Ring buffer of the start and duration of every stage of the latest `capacity` frames.
+
+    The timestamps are `time.monotonic()` seconds, the same clock as the capture timestamps of
+    `Camera`. A frame's spans may be recorded from different threads, the thread of every span is
+    kept for the trace. A disabled tracer returns from `record` immediately.
+
+    Example:
+        tracer = LatencyTracer(["capture", "steer", "send"])
+        start = time.monotonic()
+        distance = follower(roi)
+        tracer.record("steer", frame.seq, start)
+        ...
+        print(tracer.summary())
+        tracer.write_chrome_trace("storage/trace.json")  # Open in chrome://tracing or Perfetto
+
+    Attributes:
+        stages (list[str]): Names of the traced stages.
+        capacity (int): Number of frames kept, older frames are overwritten.
+        enabled (bool): Whether `record` stores the spans.
+    """
+
+    def __init__(self, stages: list[str], capacity: int = 4096, enabled: bool = True):
+        """
+        Args:
+            stages (list[str]): Names of the traced stages, in the order of a frame.
+            capacity (int): Number of frames kept.
+            enabled (bool): Whether to record, a disabled tracer allocates no buffers.
+        """
+        self.stages = list(stages)
+        self.capacity = capacity
+        self.enabled = enabled
+        self._columns = {stage: i for i, stage in enumerate(self.stages)}
+        self._thread_names = dict()
+
+        # Flat (frame, stage) lists instead of arrays, whose per-element assignment is much slower
+        rows, columns = (capacity if enabled else 0), len(self.stages)
+        self._empty_row = [math.nan] * columns
+        self._frames = [-1] * rows
+        self._starts = [math.nan] * (rows * columns)
+        self._durations = [math.nan] * (rows * columns)
+        self._threads = [0] * (rows * columns)
+
+    def record(
+        self, stage: str, frame: int, start: float, end: float | None = None
+    ) -> None:
+        """
+        Record the span of a stage of a frame.
+
+        Args:
+            stage (str): Stage name, one of `stages`.
+            frame (int): Sequence number of the frame.
+            start (float): Start of the stage (`time.monotonic()`).
+            end (float, optional): End of the stage, defaults to now.
+        """
+        if not self.enabled:
+            return
+
+        if end is None:
+            end = time.monotonic()
+        row = frame % self.capacity
+        columns = len(self._empty_row)
+        if self._frames[row] != frame:
+            # The first span of the frame overwrites the oldest frame
+            self._frames[row] = frame
+            self._starts[row * columns : (row + 1) * columns] = self._empty_row
+            self._durations[row * columns : (row + 1) * columns] = self._empty_row
+
+        index = row * columns + self._columns[stage]
+        self._starts[index] = start
+        self._durations[index] = end - start
+
+        thread = threading.get_ident()
+        self._threads[index] = thread
+        if thread not in self._thread_names:
+            self._thread_names[thread] = threading.current_thread().name
+
+    def _recorded(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Frames, starts, durations and threads of the recorded frames, in frame order."""
+        columns = len(self.stages)
+        frames = np.array(self._frames, dtype=np.int64)
+        starts = np.array(self._starts).reshape(-1, columns)
+        durations = np.array(self._durations).reshape(-1, columns)
+        threads = np.array(self._threads, dtype=np.int64).reshape(-1, columns)
+
+        rows = np.flatnonzero(frames >= 0)
+        rows = rows[np.argsort(frames[rows])]
+        return frames[rows], starts[rows], durations[rows], threads[rows]
+
+    def summary(self, frame: bool = True) -> dict[str, dict[str, float]]:
+        """
+        Percentiles of the duration of every stage and of the whole frame (from the start of its first
+        stage to the end of its last stage) over the recorded frames.
+
+        Args:
+            frame (bool): Whether to include the whole frame, which is only meaningful if this tracer
+                records every stage of the frames (not e.g. one tracer per process).
+
+        Returns:
+            dict[str, dict[str, float]]: The count, mean, p50, p95, p99 and max in milliseconds per
+                stage and for "frame".
+        """
+        _, starts, durations, _ = self._recorded()
+
+        columns = {stage: durations[:, i] * 1000 for i, stage in enumerate(self.stages)}
+        if frame:
+            # Every recorded frame has at least one span
+            ends = starts + durations
+            columns["frame"] = (
+                np.nanmax(ends, axis=1) - np.nanmin(starts, axis=1)
+            ) * 1000
+
+        summary = dict()
+        for name, values in columns.items():
+            values = values[~np.isnan(values)]
+            if len(values) == 0:
+                continue
+
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            summary[name] = {
+                "count": len(values),
+                "mean_ms": float(values.mean()),
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+                "max_ms": float(values.max()),
+            }
+
+        return summary
+
+    def write_chrome_trace(self, path: str) -> None:
+        """
+        Write the recorded spans as Chrome trace events, which can be opened in chrome://tracing or
+        https://ui.perfetto.dev.
+
+        Args:
+            path (str): Output JSON path.
+        """
+        pid = os.getpid()
+        events = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": thread,
+                "args": {"name": name},
+            }
+            for thread, name in self._thread_names.items()
+        ]
+        frames, starts, durations, threads = self._recorded()
+        for row, frame in enumerate(frames):
+            for column, stage in enumerate(self.stages):
+                start = starts[row, column]
+                if np.isnan(start):
+                    continue
+
+                events.append(
+                    {
+                        "name": stage,
+                        "cat": "frame",
+                        "ph": "X",
+                        "ts": start * 1e6,
+                        "dur": durations[row, column] * 1e6,
+                        "pid": pid,
+                        "tid": int(threads[row, column]),
+                        "args": {"frame": int(frame)},
+                    }
+                )
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
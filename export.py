@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Script for exporting a trained NvidiaModel for the on-robot inference
+
+The model is exported to TorchScript (optionally quantized to int8, calibrated on our own frames) or
+ONNX, and can then be loaded on the Raspberry Pi with `SteeringPredictor`.
+
+Usage:
+    python export.py --model ../model.pth --output storage/model_int8.pt --quantize \
+        --calibration storage/label.csv --cache-dir storage/cache
+    python export.py --model ../model.pth --output storage/model.onnx --format onnx
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+from etrobocon.models import NvidiaModel
+from etrobocon.models.checkpoint import load_checkpoint
+from etrobocon.models.inference import (
+    export_onnx,
+    export_torchscript,
+    quantize_model,
+)
+from etrobocon.data import FrameCache, load_tensor_dataset
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export the NvidiaModel")
+    parser.add_argument(
+        "--model",
+        required=True,
+        help="Trained model, a state_dict or a checkpoint written by train.py",
+    )
+    parser.add_argument("--output", required=True, help="Exported model path")
+    parser.add_argument(
+        "--format", choices=["torchscript", "onnx"], default="torchscript"
+    )
+    parser.add_argument(
+        "--quantize",
+        action="store_true",
+        help="Post-training int8 quantization (TorchScript only)",
+    )
+    parser.add_argument(
+        "--calibration", help="Label CSV file of the frames used for the calibration"
+    )
+    parser.add_argument("--calibration-samples", type=int, default=512)
+    parser.add_argument("--cache-dir", help="Preprocessed frame cache directory")
+    parser.add_argument(
+        "--engine",
+        help="Quantized engine, defaults to qnnpack on ARM and x86 otherwise",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args(argv)
+    if args.quantize and args.format != "torchscript":
+        parser.error("--quantize is only supported with --format torchscript")
+    if args.quantize and args.calibration is None:
+        parser.error("--quantize requires --calibration")
+
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    state = load_checkpoint(args.model)
+    model = NvidiaModel.from_state_dict(state.get("model", state))
+    model.eval()
+
+    if args.quantize:
+        # Calibrate the activation ranges on a random sample of our own frames
+        df = pd.read_csv(args.calibration)
+        rng = np.random.default_rng(args.seed)
+        rows = rng.choice(
+            len(df), min(args.calibration_samples, len(df)), replace=False
+        )
+        image_paths = list(df["file_path"].iloc[rows])
+        steerings = list(df["distance"].iloc[rows])
+
+        cache = None
+        if args.cache_dir:
+            # Open the cache with all frames, so that it is not rebuilt for the sample only
+            cache = FrameCache(args.cache_dir, list(df["file_path"]))
+        images, _ = load_tensor_dataset(image_paths, steerings, cache)
+
+        model = quantize_model(model, images, args.engine)
+        print(f"Quantized to int8 with {len(images)} calibration frames")
+
+    if args.format == "onnx":
+        export_onnx(model, args.output)
+    else:
+        export_torchscript(model, args.output)
+    print(f"Exported to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
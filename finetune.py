@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""Script for fine-tuning a trained NvidiaModel on new drive recordings
+
+Instead of retraining from scratch on the entire history, the model is initialized from an existing
+checkpoint and trained for a few epochs on the newly labelled frames, mixed with a replay sample of the
+old training frames so that it does not forget the old tracks. The validation loss on the old data is
+reported before and after fine-tuning to detect a regression.
+
+Usage:
+    python finetune.py --model ../model.pth --old-labels storage/label.csv \
+        --new-labels storage/label_new.csv --cache-dir storage/cache
+"""
+
+import random
+import argparse
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.tensorboard import SummaryWriter
+from sklearn.model_selection import train_test_split
+from etrobocon.models import NvidiaModel
+from etrobocon.models.checkpoint import load_checkpoint
+from etrobocon.models.acceleration import bf16_supported, optimize_model, to_device
+from etrobocon.data import (
+    BatchAugmentation,
+    DrivingRecordDataset,
+    FrameCache,
+    create_data_loader,
+    load_tensor_dataset,
+)
+import train
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fine-tune the NvidiaModel")
+    parser.add_argument(
+        "--model",
+        required=True,
+        help="Model to start from, a state_dict or a checkpoint written by train.py",
+    )
+    parser.add_argument(
+        "--old-labels",
+        required=True,
+        help="Label CSV file the model was trained on",
+    )
+    parser.add_argument(
+        "--new-labels", required=True, help="Label CSV file of the new recordings"
+    )
+    parser.add_argument("--cache-dir", help="Preprocessed frame cache directory")
+    parser.add_argument("--output", default="../model_finetuned.pth")
+    parser.add_argument(
+        "--replay-ratio",
+        type=float,
+        default=1.0,
+        help="Number of replayed old frames per new frame",
+    )
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--lr", type=float, default=1e-4)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.05,
+        help="Relative increase of the old val loss reported as a regression",
+    )
+    parser.add_argument("--seed", type=int)
+
+    # Same training options as train.py
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--val-batch-size", type=int, default=1024)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--log-every", type=int, default=10)
+    parser.add_argument("--channels-last", action="store_true")
+    parser.add_argument("--bf16", action="store_true")
+    parser.add_argument("--compile", action="store_true")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+        torch.manual_seed(args.seed)
+
+    if args.bf16 and not bf16_supported(device):
+        print(f"bf16 is not supported on {device}, falling back to fp32")
+        args.bf16 = False
+
+    old_df = pd.read_csv(args.old_labels)
+    new_df = pd.read_csv(args.new_labels)
+
+    # The same split as train.py, so the old validation frames were not trained on
+    X_old_train, X_old_val, y_old_train, y_old_val = train_test_split(
+        list(old_df["file_path"]),
+        list(old_df["distance"]),
+        test_size=0.2,
+        random_state=6,
+    )
+    X_new_train, X_new_val, y_new_train, y_new_val = train_test_split(
+        list(new_df["file_path"]),
+        list(new_df["distance"]),
+        test_size=0.2,
+        random_state=6,
+    )
+
+    # Replay a random sample of the old training frames together with the new ones
+    num_replay = min(len(X_old_train), int(args.replay_ratio * len(X_new_train)))
+    replay = np.random.choice(len(X_old_train), num_replay, replace=False)
+    X_train = X_new_train + [X_old_train[i] for i in replay]
+    y_train = y_new_train + [y_old_train[i] for i in replay]
+
+    cache = None
+    if args.cache_dir:
+        # Only the new frames are preprocessed, the old ones are copied from the existing cache
+        cache = FrameCache(
+            args.cache_dir, list(old_df["file_path"]) + list(new_df["file_path"])
+        )
+
+    train_set = DrivingRecordDataset(X_train, y_train, cache=cache)
+    augment = BatchAugmentation()
+    train_loader = create_data_loader(
+        train_set,
+        batch_size=args.batch_size,
+        shuffle=True,
+        num_workers=args.workers,
+        collate_fn=augment.collate,
+    )
+
+    val_sets = dict()
+    for name, X_val, y_val in [
+        ("old", X_old_val, y_old_val),
+        ("new", X_new_val, y_new_val),
+    ]:
+        images, labels = load_tensor_dataset(X_val, y_val, cache)
+        val_sets[name] = (
+            to_device(images, device, args.channels_last),
+            labels.to(device),
+        )
+
+    # Start from the trained model
+    state = load_checkpoint(args.model, map_location=device)
+    model = NvidiaModel.from_state_dict(state.get("model", state))
+    model.to(device)
+    optimizer = optim.Adam(model.parameters(), lr=args.lr)
+    criterion = nn.MSELoss()
+
+    train_model = optimize_model(model, args.channels_last, args.compile)
+
+    def evaluate_all():
+        return {
+            name: train.evaluate(train_model, images, labels, criterion, device, args)
+            for name, (images, labels) in val_sets.items()
+        }
+
+    before = evaluate_all()
+    print(
+        f"{len(X_new_train)} new and {num_replay} replayed frames, "
+        f"Val Loss before: old {before['old']:.4f}, new {before['new']:.4f}"
+    )
+
+    writer = SummaryWriter(comment="_finetune")
+    for epoch in range(args.epochs):
+        avg_train_loss = train.train_one_epoch(
+            train_model,
+            train_loader,
+            optimizer,
+            criterion,
+            device,
+            args,
+            desc=f"Epoch {epoch+1}/{args.epochs}",
+            writer=writer,
+            epoch=epoch,
+        )
+        val_loss = evaluate_all()
+
+        writer.add_scalar("Loss/train", avg_train_loss, epoch)
+        writer.add_scalar("Loss/val_old", val_loss["old"], epoch)
+        writer.add_scalar("Loss/val_new", val_loss["new"], epoch)
+
+        print(
+            f"Epoch {epoch+1}/{args.epochs}, Train Loss: {avg_train_loss:.4f}, "
+            f"Val Loss: old {val_loss['old']:.4f}, new {val_loss['new']:.4f}"
+        )
+    writer.close()
+
+    after = evaluate_all()
+    change = (after["old"] - before["old"]) / before["old"]
+    print(
+        f"Val Loss on old data: {before['old']:.4f} -> {after['old']:.4f} ({change:+.1%})"
+    )
+    if change > args.tolerance:
+        print(
+            f"WARNING: Validation on the old data regressed by more than {args.tolerance:.0%}"
+        )
+
+    torch.save(model.state_dict(), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""Script for scoring the line follower offline on recorded runs
+
+Every recording is decoded once, as fast as possible, and its frames are steered by the line detector
+of run.py (`LineFollower` or `ScanlineFollower`) and/or the NvidiaModel, in chunks of frames. The
+steering of each method is passed through the same PID controller as in run.py, timed by the frame
+timestamps instead of the wall clock. The recordings are replayed in parallel worker processes.
+
+Outputs a per-frame table with the distance and steering of every method and their disagreement, and
+prints a summary per recording.
+
+Usage:
+    python replay.py "storage/*_picamera.avi" --model storage/model_int8.pt --workers 4
+"""
+
+import os
+import glob
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import cv2
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from etrobocon.utils import (
+    LineFollower,
+    ScanlineFollower,
+    iter_video_frames,
+    PIDController,
+    ROI,
+    BASE_POWER,
+    PID_GAINS,
+    SEARCH_WIDTH,
+)
+from etrobocon.models.acceleration import limit_threads
+from etrobocon.models.inference import INPUT_SHAPE, SteeringPredictor
+
+# Shared between the recordings of a worker process, set by `_init_worker`
+_worker = dict()
+
+
+def _init_worker(num_threads, model_path):
+    """Limit the threads of a worker process and load the model once per process."""
+    limit_threads(num_threads)
+
+    _worker["predictor"] = (
+        SteeringPredictor(model_path) if model_path is not None else None
+    )
+
+
+def camera_distances(
+    frames: list,
+    roi: tuple[int, int, int, int],
+    follower: LineFollower | ScanlineFollower,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Distances of the line follower of run.py for a chunk of frames and whether the line was lost."""
+    x1, y1, x2, y2 = roi
+
+    distances, lost = np.empty(len(frames)), np.empty(len(frames), dtype=bool)
+    for i, frame in enumerate(frames):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        detection = follower(gray[y1:y2, x1:x2])
+        # Distance between ROI center and the centroid in x coordinates
+        distances[i] = detection.mx - ((x2 - x1) / 2)
+        lost[i] = detection.lost
+
+    return distances, lost
+
+
+def model_distances(frames: list, predictor: SteeringPredictor) -> np.ndarray:
+    """Distances predicted by the model for a chunk of frames, as one batch."""
+    inputs = np.empty((len(frames), *INPUT_SHAPE), dtype=np.float32)
+    for i, frame in enumerate(frames):
+        inputs[i] = predictor.preprocess(frame)[0]
+
+    return predictor.predict_batch(inputs).astype(np.float64)
+
+
+def pid_steering(distances: np.ndarray, timestamps: np.ndarray, args) -> np.ndarray:
+    """Steering (-1 ~ 1) of run.py for a sequence of distances, NaN where the distance is NaN."""
+    kp, ki, kd = args.pid
+    pid = PIDController(
+        Kp=kp,
+        Ki=ki,
+        Kd=kd,
+        setpoint=0,
+        output_limits=(-args.base_power, args.base_power),
+    )
+
+    steering = np.full(len(distances), np.nan)
+    for i, (distance, timestamp) in enumerate(zip(distances, timestamps)):
+        if not np.isnan(distance):
+            steering[i] = pid.update(distance, current_time=timestamp) / args.base_power
+
+    return steering
+
+
+def frame_times(video_path: str, frame_numbers: np.ndarray, fps: float) -> np.ndarray:
+    """
+    Time of the frames in seconds since the first frame of the recording.
+
+    Read from the capture timestamps which run.py and collector.py write next to the video, since
+    the frames dropped by their recording are missing from the video. Frame number / fps for the
+    recordings without timestamps.
+    """
+    path = f"{os.path.splitext(video_path)[0]}_timestamps.csv"
+    if os.path.exists(path) and len(frame_numbers) > 0:
+        timestamps = pd.read_csv(path)["timestamp"].to_numpy()
+        if frame_numbers.max() < len(timestamps):
+            return timestamps[frame_numbers] - timestamps[0]
+        print(f"{path}: fewer timestamps than frames, timed by --fps instead")
+
+    return frame_numbers / fps
+
+
+def replay_video(video_path: str, args) -> tuple[pd.DataFrame, dict]:
+    """
+    Replay one recording.
+
+    Returns:
+        tuple[pd.DataFrame, dict]: The per-frame results and the summary of the recording.
+    """
+    predictor = _worker.get("predictor")
+    methods = [
+        method
+        for method, enabled in [
+            ("camera", args.method in ("camera", "both")),
+            ("model", args.method in ("model", "both")),
+        ]
+        if enabled
+    ]
+
+    start = time.perf_counter()
+    if args.detector == "scanlines":
+        follower = ScanlineFollower()
+    else:
+        follower = LineFollower(search_width=args.search_width)
+    frame_numbers, distances = list(), {method: list() for method in methods}
+    camera_lost = list()
+    for numbers, frames in iter_video_frames(video_path, args.chunk_size, args.stride):
+        frame_numbers.extend(numbers)
+        if "camera" in distances:
+            chunk_distances, chunk_lost = camera_distances(frames, args.roi, follower)
+            distances["camera"].append(chunk_distances)
+            camera_lost.append(chunk_lost)
+        if "model" in distances:
+            distances["model"].append(model_distances(frames, predictor))
+    elapsed = time.perf_counter() - start
+
+    df = pd.DataFrame({"video": video_path, "frame": frame_numbers})
+    df["time"] = frame_times(video_path, df["frame"].to_numpy(), args.fps)
+    for method in methods:
+        values = np.concatenate(distances[method]) if frame_numbers else np.empty(0)
+        df[f"{method}_distance"] = values
+        df[f"{method}_steer"] = pid_steering(values, df["time"].to_numpy(), args)
+
+    summary = {
+        "video": video_path,
+        "frames": len(df),
+        "fps": len(df) / elapsed if elapsed > 0 else float("nan"),
+    }
+    if "camera" in distances:
+        df["camera_lost"] = np.concatenate(camera_lost) if camera_lost else False
+        summary["camera_lost"] = int(df["camera_lost"].sum())
+    if len(methods) == 2:
+        df["distance_diff"] = df["model_distance"] - df["camera_distance"]
+        df["steer_diff"] = df["model_steer"] - df["camera_steer"]
+        summary["mean_abs_distance_diff"] = float(df["distance_diff"].abs().mean())
+        summary["mean_abs_steer_diff"] = float(df["steer_diff"].abs().mean())
+        summary["max_abs_steer_diff"] = float(df["steer_diff"].abs().max())
+
+    return df, summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded runs offline")
+    parser.add_argument(
+        "videos",
+        nargs="*",
+        default=["storage/*_picamera.avi"],
+        help="Recordings or glob patterns",
+    )
+    parser.add_argument(
+        "--method",
+        choices=["camera", "model", "both"],
+        help="Steering methods to replay, defaults to both with --model and camera otherwise",
+    )
+    parser.add_argument("--model", help="Model for the model method (.pt, .onnx, .pth)")
+    parser.add_argument("--output", default="storage/replay.csv")
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Recordings replayed in parallel"
+    )
+    parser.add_argument(
+        "--threads-per-worker",
+        type=int,
+        help="Threads of every worker, defaults to the CPUs divided by --workers",
+    )
+    parser.add_argument("--stride", type=int, default=1, help="Replay every N-th frame")
+    parser.add_argument("--chunk-size", type=int, default=64)
+    parser.add_argument(
+        "--fps",
+        type=float,
+        default=20.0,
+        help="Frame rate of the recordings without timestamps",
+    )
+    parser.add_argument(
+        "--roi", type=int, nargs=4, default=ROI, metavar=("X1", "Y1", "X2", "Y2")
+    )
+    parser.add_argument(
+        "--detector",
+        choices=["contours", "scanlines"],
+        default="contours",
+        help="Line detector of the camera method, as LINE_DETECTOR in run.py",
+    )
+    parser.add_argument(
+        "--search-width",
+        type=int,
+        default=SEARCH_WIDTH,
+        help="Tracking window of the line follower, 0 to search the full ROI",
+    )
+    parser.add_argument(
+        "--pid", type=float, nargs=3, default=PID_GAINS, metavar=("KP", "KI", "KD")
+    )
+    parser.add_argument("--base-power", type=float, default=BASE_POWER)
+
+    args = parser.parse_args(argv)
+    args.search_width = args.search_width or None
+    if args.method is None:
+        args.method = "both" if args.model is not None else "camera"
+    if args.method in ("model", "both") and args.model is None:
+        parser.error(f"--method {args.method} requires --model")
+
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    video_paths = sorted(
+        {path for pattern in args.videos for path in glob.glob(pattern)}
+    )
+    if not video_paths:
+        raise SystemExit(f"No recordings found for {args.videos}")
+
+    workers = min(args.workers, len(video_paths))
+    threads = args.threads_per_worker or max(1, os.cpu_count() // workers)
+    print(
+        f"Replaying {len(video_paths)} recordings ({args.method}), "
+        f"{workers} in parallel with {threads} threads each"
+    )
+
+    start = time.perf_counter()
+    tables, summaries = list(), list()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(threads, args.model if args.method != "camera" else None),
+    ) as executor:
+        futures = [
+            executor.submit(replay_video, video_path, args)
+            for video_path in video_paths
+        ]
+        for future in as_completed(futures):
+            df, summary = future.result()
+            tables.append(df)
+            summaries.append(summary)
+            print(f"{summary['video']}: {summary['frames']} frames")
+    elapsed = time.perf_counter() - start
+
+    df = pd.concat(tables).sort_values(["video", "frame"])
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    df.to_csv(args.output, index=False)
+
+    summary = pd.DataFrame(summaries).sort_values("video")
+    print(summary.to_string(index=False, float_format="{:.3f}".format))
+    print(
+        f"{len(df)} frames in {elapsed:.1f}s ({len(df) / elapsed:.1f} frames/sec), "
+        f"per-frame results written to {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,49 @@
 #!/usr/bin/env python3
 import cv2
 import time
+import queue
 import socket
 import pickle
 import struct
-from etrobocon.unit import ETRobot
-from etrobocon.utils import steer_by_camera, draw_driving_info, PIDController
+import multiprocessing
+from etrobocon.unit import ETRobot, Camera, CameraFrame
+from etrobocon.utils import (
+    LineFollower,
+    ScanlineFollower,
+    draw_driving_info,
+    PIDController,
+    DropOldestQueue,
+    Stage,
+    FrameBus,
+    LatencyTracer,
+    ROI,
+    BASE_POWER,
+    PID_GAINS,
+    SEARCH_WIDTH,
+)
 
 # User defined constants
 FILE_LABEL = time.strftime(
     "%Y%m%d%H%M%S", time.localtime()
 )  # Label for saved camera capture and steering data
 SPECIFIED_FPS = 20  # PICamera fps
-BASE_POWER = 50  # Base motor power
-x1, y1, x2, y2 = 100, 200, 540, 300  # Region of Interest
+FRAME_WIDTH, FRAME_HEIGHT = 640, 480  # Camera, recording and frame bus resolution
+CAMERA_FORMAT = "MJPG"  # Pixel format of the camera, e.g. "MJPG" or "YUYV"
+CAMERA_BUFFER_SIZE = 1  # Frames buffered by the camera driver
+x1, y1, x2, y2 = ROI  # Region of Interest, tuned in etrobocon/utils/driving.py
+LINE_DETECTOR = "contours"  # "contours": LineFollower; "scanlines": ScanlineFollower
 HOST_IP_ADDRESS = (
     "192.168.137.1"  # The destination IP that the Raspberry Pi will send to
 )
-
-# Camera
-cap = cv2.VideoCapture(0)
-cap.set(cv2.CAP_PROP_FPS, SPECIFIED_FPS)
-
-fourcc = cv2.VideoWriter_fourcc(*"XVID")
-out = cv2.VideoWriter(
-    filename=f"storage/{FILE_LABEL}_picamera.avi",
-    fourcc=fourcc,
-    fps=20.0,
-    frameSize=(640, 480),
-)
-
+DRIVING_MODE = "camera"  # "camera": contour-based line tracing; "model": NvidiaModel
+MODEL_PATH = "storage/model_int8.pt"  # Exported by export.py, for the "model" mode
+RECORDING_QUEUE_SIZE = 32  # Frames buffered for the video writer before dropping
+TELEMETRY_QUEUE_SIZE = 2  # Frames buffered for the telemetry before dropping
+SIDE_STAGES = "threads"  # "threads" or "processes" for the recording and telemetry
+BUS_SLOTS = 8  # Frames kept in the shared memory for the "processes" side stages
+SHUTDOWN_TIMEOUT = 5.0  # Seconds for the side processes to stop before terminating them
+TRACING = True  # Trace the latency of every stage, reported when the run ends
+TRACE_CAPACITY = 4096  # Latest frames kept by the tracer
 
 # Driving data recorder
 # https://stackoverflow.com/questions/47743246/getting-timestamp-of-each-frame-in-a-video
@@ -38,60 +52,349 @@ out = cv2.VideoWriter(
 client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 client_socket.connect((HOST_IP_ADDRESS, 8485))
 
+# Per-frame latency of the stages, "capture" is the age of the frame when the steering gets it
+tracer = LatencyTracer(
+    ["capture", "steer", "pid", "motor", "overlay", "encode", "send"],
+    capacity=TRACE_CAPACITY,
+    enabled=TRACING,
+)
+
+
+def send_telemetry(item):
+    """Telemetry stage: draw the driving information and send the frame to the pc."""
+    seq, gray, info = item
+    start = time.monotonic()
+    gray = draw_driving_info(gray, info, (x1, y1, x2, y2))
+    tracer.record("overlay", seq, start)
+
+    start = time.monotonic()
+    ret, buffer = cv2.imencode(".png", gray)
+    img_encoded = buffer.tobytes()
+    data = pickle.dumps(img_encoded)
+    tracer.record("encode", seq, start)
+
+    start = time.monotonic()
+    client_socket.sendall(struct.pack("L", len(data)) + data)
+    tracer.record("send", seq, start)
+
+
+def report_trace(title="latency", label="", frame=True):
+    """
+    Print the latency percentiles of the traced stages under `title` and write the Chrome trace with
+    the file name suffix `label`. Without `frame`, the whole frame is left out of the percentiles.
+    """
+    if not tracer.enabled:
+        return
+
+    print(f"{title}:")
+    for stage, stats in tracer.summary(frame=frame).items():
+        print(
+            f"{stage}: p50 {stats['p50_ms']:.2f} ms, p95 {stats['p95_ms']:.2f} ms, "
+            f"p99 {stats['p99_ms']:.2f} ms, max {stats['max_ms']:.2f} ms ({stats['count']} frames)"
+        )
+
+    path = f"storage/{FILE_LABEL}_trace{label}.json"
+    tracer.write_chrome_trace(path)
+    print(f"Chrome trace written to {path}")
+
+
+def open_recording():
+    """
+    Open the video of the recording and the capture timestamps of its frames, in the thread or
+    process which writes them. A writer inherited by a forked process would finalize the file again
+    when the other process exits.
+
+    Frames dropped by the recording are missing from the video, so replay.py times the frames with
+    the timestamps (one row per video frame) instead of the frame rate of the video.
+    """
+    fourcc = cv2.VideoWriter_fourcc(*"XVID")
+    out = cv2.VideoWriter(
+        filename=f"storage/{FILE_LABEL}_picamera.avi",
+        fourcc=fourcc,
+        fps=20.0,
+        frameSize=(FRAME_WIDTH, FRAME_HEIGHT),
+    )
+    timestamps = open(f"storage/{FILE_LABEL}_picamera_timestamps.csv", "w")
+    timestamps.write("seq,timestamp\n")
+    return out, timestamps
+
+
+def record_frame(frame, out, timestamps):
+    """Recording stage: write a captured frame to the video and its timestamp next to it."""
+    out.write(frame.image)
+    timestamps.write(f"{frame.seq},{frame.timestamp}\n")
+
+
+def record_frames(bus):
+    """Recording process: write every frame of the bus to the video."""
+    out, timestamps = open_recording()
+    # Copied out of the bus first, a slow encoder must not write frames overwritten meanwhile
+    for seq, frame in bus.frames(start=0, copy=True):
+        timestamp = bus.timestamp(seq)
+        if not bus.valid(seq):
+            bus.dropped += 1  # Overwritten before its timestamp was read
+            continue
+        record_frame(CameraFrame(seq, timestamp, frame), out, timestamps)
+    out.release()
+    timestamps.close()
+
+    print(f"recording: {bus.dropped} dropped")
+
+
+def send_telemetry_frames(bus, info_queue):
+    """Telemetry process: send the frames of the bus with the driving information of the steering."""
+    sent = dropped = errors = 0
+    while (item := info_queue.get()) is not None:
+        seq, info = item
+        frame = bus.read(seq)
+        if frame is None:  # Overwritten, the telemetry fell behind
+            dropped += 1
+            continue
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if not bus.valid(seq):  # Overwritten during the conversion
+            dropped += 1
+            continue
+
+        try:
+            send_telemetry((seq, gray, info))
+            sent += 1
+        except Exception:
+            errors += 1
+
+    print(f"telemetry: {sent} sent, {dropped} dropped, {errors} errors")
+    # The capture to motor spans are in the tracer of the main process, so no whole frame here
+    report_trace(
+        "latency of the telemetry process (overlay, encode and send only)",
+        "_telemetry",
+        frame=False,
+    )
+
+
+def put_latest(info_queue, item):
+    """
+    Put an item into a multiprocessing queue without blocking, dropping the oldest items while the
+    queue is full like `DropOldestQueue`. Returns the number of dropped items.
+    """
+    dropped = 0
+    while True:
+        try:
+            info_queue.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                info_queue.get_nowait()
+                dropped += 1
+            except queue.Empty:
+                pass  # Taken by the consumer meanwhile
+
+
+def stop_side_processes(bus, info_queue, processes):
+    """
+    Close the bus and stop the side processes. The stop item is put without blocking, even if the
+    telemetry process died with a full queue, and the processes which do not finish within
+    `SHUTDOWN_TIMEOUT` are terminated.
+    """
+    bus.close()
+    put_latest(info_queue, None)
+    for process in processes:
+        process.join(timeout=SHUTDOWN_TIMEOUT)
+        if process.is_alive():
+            print(
+                f"{process.name}: did not stop within {SHUTDOWN_TIMEOUT} s, terminating"
+            )
+            process.terminate()
+            process.join()
+
 
 def main():
+    # Side processes are forked (they inherit the socket) before the robot and
+    # the model are initialized, the frames are shared with them through the frame bus
+    bus, processes = None, list()
+    if SIDE_STAGES == "processes":
+        context = multiprocessing.get_context("fork")
+        bus = FrameBus(slots=BUS_SLOTS, shape=(FRAME_HEIGHT, FRAME_WIDTH, 3))
+        info_queue = context.Queue(TELEMETRY_QUEUE_SIZE)
+        processes = [
+            context.Process(
+                target=record_frames, args=(bus,), name="recording", daemon=True
+            ),
+            context.Process(
+                target=send_telemetry_frames,
+                args=(bus, info_queue),
+                name="telemetry",
+                daemon=True,
+            ),
+        ]
+        for process in processes:
+            process.start()
+
+    kp, ki, kd = PID_GAINS
     pid = PIDController(
-        Kp=0.1, Ki=0.001, Kd=0, setpoint=0, output_limits=(-BASE_POWER, BASE_POWER)
+        Kp=kp, Ki=ki, Kd=kd, setpoint=0, output_limits=(-BASE_POWER, BASE_POWER)
     )
     et = ETRobot()
 
-    while et.is_running == True:
-        ret, frame = cap.read()
-        if not ret:
-            print("Can't receive frame (stream end?). Exiting ...")
-            break
+    # Loaded and warmed up before driving, so the first frames meet the frame budget
+    predictor = None
+    if DRIVING_MODE == "model":
+        # Imported here, torch is only needed for the "model" mode (not in requirements-raspi.txt)
+        from etrobocon.models.inference import SteeringPredictor
+
+        predictor = SteeringPredictor(MODEL_PATH)
+    if LINE_DETECTOR == "scanlines":
+        follower = ScanlineFollower()
+    else:
+        follower = LineFollower(search_width=SEARCH_WIDTH)
 
-        out.write(frame)
+    # Stages connected by queues which drop the oldest item when full, so the camera and the
+    # steering never wait for the recording or the telemetry
+    stages = list()
+    if bus is None:
+        recording_queue = DropOldestQueue(RECORDING_QUEUE_SIZE)
+        telemetry_queue = DropOldestQueue(TELEMETRY_QUEUE_SIZE)
+        out, timestamps = open_recording()
+        stages = [
+            Stage(
+                "recording",
+                recording_queue,
+                lambda frame: record_frame(frame, out, timestamps),
+            ),
+            Stage("telemetry", telemetry_queue, send_telemetry),
+        ]
+        next_buffer, on_frame = None, recording_queue.put
+    else:
+        # Captured straight into the shared memory, the side processes read it from there
+        next_buffer, on_frame = bus.next_slot, lambda frame: bus.commit(frame.timestamp)
+    telemetry_drops = 0
+    for stage in stages:
+        stage.start()
 
-        gray = cv2.cvtColor(frame.copy(), cv2.COLOR_BGR2GRAY)
+    # The camera drains the driver on its own thread, the steering always gets the newest frame and
+    # the recording every frame
+    camera = Camera(
+        0,
+        width=FRAME_WIDTH,
+        height=FRAME_HEIGHT,
+        fps=SPECIFIED_FPS,
+        buffer_size=CAMERA_BUFFER_SIZE,
+        pixel_format=CAMERA_FORMAT,
+        next_buffer=next_buffer,
+        on_frame=on_frame,
+    )
+    if (camera.width, camera.height) != (FRAME_WIDTH, FRAME_HEIGHT):
+        # The frame bus and the video writer are sized for the requested resolution
+        camera.release()
+        et.stop()
+        if bus is not None:
+            stop_side_processes(bus, info_queue, processes)
+            bus.detach()
+        raise ValueError(
+            f"The camera applied {camera.width}x{camera.height} instead of "
+            f"{FRAME_WIDTH}x{FRAME_HEIGHT}, set FRAME_WIDTH and FRAME_HEIGHT to a supported "
+            "resolution"
+        )
 
-        roi = gray[y1:y2, x1:x2]
+    # Steering and actuation stage, the motors are stopped and the camera is released even if it
+    # fails (e.g. the grab thread of the camera), the ETRobot thread would keep driving otherwise
+    try:
+        while et.is_running == True:
+            try:
+                captured = camera.read(timeout=1.0)
+            except TimeoutError:
+                continue
+            if captured is None:
+                print("Can't receive frame (stream end?). Exiting ...")
+                break
+            frame = captured.image
+            tracer.record("capture", captured.seq, captured.timestamp)
 
-        mx, my, _ = steer_by_camera(roi=roi)
-        # Distance between ROI center and the centroid in x coordinates
-        distance = mx - (roi.shape[1] / 2)
+            start = time.monotonic()
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 
-        # Steering angle range: -1 ~ 1 (1: trun right; -1: turn left)
-        steer = pid.update(distance) / BASE_POWER
-        left_power = BASE_POWER * (1 + steer) if steer <= 0 else BASE_POWER
-        right_power = BASE_POWER * (1 - steer) if steer >= 0 else BASE_POWER
+            roi = gray[y1:y2, x1:x2]
 
-        et.set_motor_power(left_power=int(left_power), right_power=int(right_power))
+            if predictor is not None:
+                distance = predictor.predict(frame)
+                # Predicted line position, drawn at the vertical center of the ROI
+                mx, my = distance + (roi.shape[1] / 2), roi.shape[0] / 2
+            else:
+                # Keeps the last line position if the line is lost
+                mx, my, _, _ = follower(roi)
+                # Distance between ROI center and the centroid in x coordinates
+                distance = mx - (roi.shape[1] / 2)
+            tracer.record("steer", captured.seq, start)
+            if bus is not None and not bus.valid(captured.seq):
+                # The frame was overwritten while steering with it, the steering fell behind by the
+                # whole bus, so the result is discarded
+                continue
 
-        # Draw driving information for the real-time inspection
-        info = dict()
-        info["mx"], info["my"] = mx, my
-        info["text"] = {
-            "distance": distance,
-            "steer": steer,
-            "left_power": left_power,
-            "right_power": right_power,
-        }
-        gray = draw_driving_info(gray, info, (x1, y1, x2, y2))
+            # Steering angle range: -1 ~ 1 (1: trun right; -1: turn left)
+            start = time.monotonic()
+            steer = pid.update(distance) / BASE_POWER
+            tracer.record("pid", captured.seq, start)
+            left_power = BASE_POWER * (1 + steer) if steer <= 0 else BASE_POWER
+            right_power = BASE_POWER * (1 - steer) if steer >= 0 else BASE_POWER
 
-        # Send camera capture to pc
-        ret, buffer = cv2.imencode(".png", gray)
-        img_encoded = buffer.tobytes()
-        data = pickle.dumps(img_encoded)
-        client_socket.sendall(struct.pack("L", len(data)) + data)
+            start = time.monotonic()
+            et.set_motor_power(left_power=int(left_power), right_power=int(right_power))
+            tracer.record("motor", captured.seq, start)
 
-        if cv2.waitKey(1) & 0xFF == ord("q") or not ret:
-            break
+            # Driving information for the real-time inspection, drawn by the telemetry stage
+            info = dict()
+            info["mx"], info["my"] = mx, my
+            info["text"] = {
+                "distance": distance,
+                "steer": steer,
+                "left_power": left_power,
+                "right_power": right_power,
+                # Age of the frame when the motors are set, and the newer frames it skipped
+                "age_ms": (time.monotonic() - captured.timestamp) * 1000,
+                "skipped": captured.skipped,
+            }
+            if predictor is None:
+                info["text"]["vision_ms"] = follower.cost * 1000
+            if bus is None:
+                info["text"]["record_drop"] = recording_queue.dropped
+                info["text"]["telemetry_drop"] = telemetry_queue.dropped
+                telemetry_queue.put((captured.seq, gray, info))
+            else:
+                # Only the sequence number of the frame is sent, the process reads it from the bus
+                telemetry_drops += put_latest(info_queue, (captured.seq, info))
+    finally:
+        et.stop()
 
-    et.stop()
+        camera.release()
+        if bus is None:
+            recording_queue.close()
+            telemetry_queue.close()
+        else:
+            stop_side_processes(bus, info_queue, processes)
+        for stage in stages:
+            stage.join()
 
-    cap.release()
-    out.release()
+        print(
+            f"camera: {camera.frame_count} frames, steering: {camera.skipped} skipped"
+        )
+        if bus is not None:
+            print(f"telemetry queue: {telemetry_drops} dropped")
+        for stage in stages:
+            stats = stage.stats()
+            print(
+                f"{stats['stage']}: {stats['processed']} processed, {stats['dropped']} dropped, "
+                f"{stats['errors']} errors, {stats['busy_ms_per_item']:.1f} ms/item"
+            )
+        if bus is None:
+            report_trace()
+            out.release()  # Released by the recording process otherwise
+            timestamps.close()
+        else:
+            report_trace(
+                "latency of the steering process (frame: capture to motor only)"
+            )
+            # The steering's views of the shared memory are released before the bus
+            captured = frame = None
+            bus.detach()
 
 
 if __name__ == "__main__":
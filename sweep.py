@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""Script for running a hyperparameter sweep of the NvidiaModel
+
+Every trial balances the labels with its own bin settings, trains with its own learning rate, batch
+size and augmentation probabilities and reports its best validation loss to one results table. Trials
+run in parallel worker processes, each with its own thread budget, and share the preprocessed frame
+cache. A trial is stopped early if its validation loss is clearly worse than that of the other trials
+at the same epoch (median stopping rule).
+
+Usage:
+    python sweep.py --labels storage/label.csv --cache-dir storage/cache --search random --trials 32
+"""
+
+import os
+import time
+import random
+import argparse
+import itertools
+import multiprocessing
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sklearn.model_selection import train_test_split
+from etrobocon.models import NvidiaModel
+from etrobocon.models.acceleration import limit_threads
+from etrobocon.data import (
+    BatchAugmentation,
+    DrivingRecordDataset,
+    FrameCache,
+    balance_dataset,
+    create_data_loader,
+    load_tensor_dataset,
+)
+import train
+
+# Values tried for every hyperparameter
+SEARCH_SPACE = {
+    "lr": [3e-4, 1e-3, 3e-3],
+    "batch_size": [64, 128, 256],
+    "shift_scale_p": [0.0, 0.5],
+    "brightness_contrast_p": [0.0, 0.5],
+    "flip_p": [0.5],
+    "num_bins": [25, 50],
+    "max_samples": [500, 1000, 2000],
+}
+
+# Shared between the trials of a worker process, set by `_init_worker`
+_worker = dict()
+
+
+def _init_worker(num_threads, history, lock, cache):
+    """Limit the threads of a worker process so that parallel trials do not oversubscribe the CPU."""
+    limit_threads(num_threads, interop_threads=1)
+
+    _worker.update(history=history, lock=lock, cache=cache)
+
+
+def generate_configs(search: str, num_trials: int, seed: int) -> list[dict]:
+    """Grid or random search configurations over `SEARCH_SPACE`."""
+    keys = list(SEARCH_SPACE)
+
+    if search == "grid":
+        return [
+            dict(zip(keys, values))
+            for values in itertools.product(*SEARCH_SPACE.values())
+        ]
+
+    rng = random.Random(seed)
+    return [
+        {key: rng.choice(SEARCH_SPACE[key]) for key in keys} for _ in range(num_trials)
+    ]
+
+
+def should_stop(epoch: int, val_loss: float, args) -> bool:
+    """
+    Median stopping rule: after the grace epochs, stop a trial whose validation loss is worse than
+    `stop_factor` times the median of the other trials at the same epoch.
+    """
+    with _worker["lock"]:
+        losses = _worker["history"].get(epoch, [])
+        _worker["history"][epoch] = losses + [val_loss]
+
+    if epoch + 1 < args.grace_epochs or len(losses) < args.min_trials:
+        return False
+
+    return val_loss > args.stop_factor * float(np.median(losses))
+
+
+def run_trial(trial_id: int, config: dict, args) -> dict:
+    """Train the model with one configuration and return its results."""
+    start = time.perf_counter()
+    torch.manual_seed(args.seed + trial_id)
+
+    # Balance the labels with the bin settings of the trial
+    df = pd.read_csv(args.labels)
+    df = balance_dataset(
+        df, "distance", config["max_samples"], config["num_bins"], args.seed
+    )
+
+    X_train, X_val, y_train, y_val = train_test_split(
+        list(df["file_path"]), list(df["distance"]), test_size=0.2, random_state=6
+    )
+
+    cache = _worker["cache"]
+    train_set = DrivingRecordDataset(X_train, y_train, cache=cache)
+    val_images, val_labels = load_tensor_dataset(X_val, y_val, cache)
+
+    augment = BatchAugmentation(
+        shift_scale_p=config["shift_scale_p"],
+        brightness_contrast_p=config["brightness_contrast_p"],
+        flip_p=config["flip_p"],
+    )
+    train_loader = create_data_loader(
+        train_set,
+        batch_size=config["batch_size"],
+        shuffle=True,
+        num_workers=args.loader_workers,
+        collate_fn=augment.collate,
+    )
+
+    # The options read by `train.train_one_epoch` and `train.evaluate`, fp32 eager on the CPU
+    train_args = argparse.Namespace(
+        channels_last=False,
+        bf16=False,
+        distill_alpha=0.0,  # No teacher
+        log_every=1,  # No TensorBoard writer
+        val_batch_size=args.val_batch_size,
+    )
+    device = torch.device("cpu")
+
+    model = NvidiaModel()
+    optimizer = optim.Adam(model.parameters(), lr=config["lr"])
+    criterion = nn.MSELoss()
+
+    best_val_loss, stopped_early = float("inf"), False
+    for epoch in range(args.epochs):
+        train.train_one_epoch(
+            model,
+            train_loader,
+            optimizer,
+            criterion,
+            device,
+            train_args,
+            progress=False,
+        )
+        val_loss = train.evaluate(
+            model, val_images, val_labels, criterion, device, train_args
+        )
+        best_val_loss = min(best_val_loss, val_loss)
+
+        if should_stop(epoch, val_loss, args) and epoch + 1 < args.epochs:
+            stopped_early = True
+            break
+
+    return {
+        "trial": trial_id,
+        **config,
+        "num_samples": len(df),
+        "best_val_loss": best_val_loss,
+        "epochs": epoch + 1,
+        "stopped_early": stopped_early,
+        "time": time.perf_counter() - start,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Hyperparameter sweep")
+    parser.add_argument(
+        "--labels",
+        required=True,
+        help="Unbalanced label CSV file, e.g. the output of label_dataset",
+    )
+    parser.add_argument(
+        "--cache-dir", required=True, help="Preprocessed frame cache shared by trials"
+    )
+    parser.add_argument("--results", default="storage/sweep.csv")
+    parser.add_argument("--search", choices=["grid", "random"], default="random")
+    parser.add_argument(
+        "--trials", type=int, default=16, help="Number of random search trials"
+    )
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Number of trials running in parallel"
+    )
+    parser.add_argument(
+        "--threads-per-worker",
+        type=int,
+        help="Torch threads of every trial, defaults to the CPUs divided by --workers",
+    )
+    parser.add_argument(
+        "--loader-workers", type=int, default=0, help="DataLoader workers of a trial"
+    )
+    parser.add_argument("--val-batch-size", type=int, default=1024)
+    parser.add_argument("--seed", type=int, default=0)
+
+    # Early stopping
+    parser.add_argument(
+        "--grace-epochs", type=int, default=3, help="Epochs before a trial may stop"
+    )
+    parser.add_argument(
+        "--min-trials",
+        type=int,
+        default=3,
+        help="Trials which must have reached an epoch before comparing against them",
+    )
+    parser.add_argument(
+        "--stop-factor",
+        type=float,
+        default=1.5,
+        help="Stop a trial whose val loss exceeds this factor times the median",
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    threads = args.threads_per_worker or max(1, os.cpu_count() // args.workers)
+    configs = generate_configs(args.search, args.trials, args.seed)
+    if not configs:
+        raise SystemExit("No trials to run, check --trials")
+    print(
+        f"{len(configs)} trials, {args.workers} in parallel with {threads} threads each"
+    )
+
+    # Preprocess all frames once, the trials only read from the cache
+    df = pd.read_csv(args.labels)
+    cache = FrameCache(args.cache_dir, list(df["file_path"]))
+
+    manager = multiprocessing.Manager()
+    history, lock = manager.dict(), manager.Lock()
+
+    results = list()
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=_init_worker,
+        initargs=(threads, history, lock, cache),
+    ) as executor:
+        futures = [
+            executor.submit(run_trial, trial_id, config, args)
+            for trial_id, config in enumerate(configs)
+        ]
+
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            print(
+                f"Trial {result['trial']}: best val loss {result['best_val_loss']:.4f} "
+                f"after {result['epochs']} epochs"
+                + (" (stopped early)" if result["stopped_early"] else "")
+            )
+
+            # Rewrite the table after every trial, so that partial results survive an interruption
+            table = pd.DataFrame(results).sort_values("best_val_loss")
+            os.makedirs(os.path.dirname(args.results) or ".", exist_ok=True)
+            table.to_csv(args.results, index=False)
+
+    print(table.head(10).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
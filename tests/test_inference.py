@@ -0,0 +1,51 @@
+import cv2
+import numpy as np
+import pytest
+import torch
+from etrobocon.data import DrivingRecordDataset
+from etrobocon.models.inference import INPUT_SHAPE, FramePreprocessor
+from etrobocon.utils import preprocess_frame
+
+
+def random_frames(num_frames, shape=(480, 640, 3), seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, shape, dtype=np.uint8) for _ in range(num_frames)]
+
+
+def test_frame_preprocessor_matches_preprocess_frame():
+    preprocessor = FramePreprocessor()
+
+    # The output buffer is reused, every frame must still match
+    for frame in random_frames(8):
+        expected = torch.from_numpy(
+            (preprocess_frame(frame) / 255).transpose(2, 0, 1)
+        ).to(torch.float32)
+
+        actual = preprocessor(frame)
+
+        assert actual.shape == (1, *INPUT_SHAPE)
+        assert torch.equal(torch.from_numpy(actual[0]), expected)
+
+
+def test_frame_preprocessor_matches_driving_record_dataset(tmp_path):
+    frames = random_frames(4, seed=1)
+    image_paths = list()
+    for i, frame in enumerate(frames):
+        image_paths.append(str(tmp_path / f"{i}.png"))
+        cv2.imwrite(image_paths[-1], frame)  # Lossless
+    dataset = DrivingRecordDataset(image_paths, [0.0] * len(frames))
+    preprocessor = FramePreprocessor()
+
+    for i, frame in enumerate(frames):
+        expected, _ = dataset[i]
+
+        preprocessor(frame)
+
+        assert torch.equal(preprocessor.tensor[0], expected)
+
+
+def test_frame_preprocessor_rejects_other_frame_shapes():
+    preprocessor = FramePreprocessor()
+
+    with pytest.raises(ValueError):
+        preprocessor(np.zeros((240, 320, 3), dtype=np.uint8))
@@ -1,81 +1,391 @@
+#!/usr/bin/env python3
+"""Script for performing the training task
+
+Usage:
+    python train.py --labels storage/label.csv --cache-dir storage/cache --channels-last --bf16
+"""
+
+import os
+import time
+import random
+import argparse
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
+import pandas as pd
 from torch.utils.tensorboard import SummaryWriter
 from tqdm import tqdm
 from sklearn.model_selection import train_test_split
 from etrobocon.models import NvidiaModel
-from etrobocon.data import transform, flip_transform, DrivingRecordDataset
+from etrobocon.models.acceleration import (
+    bf16_supported,
+    optimize_model,
+    to_device,
+    autocast,
+)
+from etrobocon.models.checkpoint import (
+    CheckpointWriter,
+    load_checkpoint,
+    capture_rng_state,
+    restore_rng_state,
+)
+from etrobocon.utils import StepTimer, peak_rss_mb
+from etrobocon.data import (
+    BatchAugmentation,
+    DrivingRecordDataset,
+    FrameCache,
+    create_data_loader,
+    load_tensor_dataset,
+)
 
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-# TensorBoard, visualize the log by running: `tensorboard --logdir=runs`
-writer = SummaryWriter()
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Train the NvidiaModel")
+    parser.add_argument(
+        "--labels",
+        required=True,
+        help="Balanced label CSV file with the columns file_path and distance",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory of the preprocessed frame cache (e.g. storage/cache), "
+        "decode the images in every epoch if not given",
+    )
+    parser.add_argument("--output", default="../model.pth", help="Trained model path")
+    parser.add_argument(
+        "--checkpoint-dir",
+        default="storage/checkpoints",
+        help="Directory of the periodic (last.pth) and best (best.pth) checkpoints",
+    )
+    parser.add_argument(
+        "--checkpoint-every", type=int, default=1, help="Checkpoint every N epochs"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue the run from the last checkpoint in --checkpoint-dir",
+    )
+    parser.add_argument(
+        "--width-mult", type=float, default=1.0, help="Channel multiplier of the model"
+    )
+    parser.add_argument(
+        "--depth-mult",
+        type=float,
+        default=1.0,
+        help="Multiplier of the number of 3x3 convolutions of the model",
+    )
+    parser.add_argument(
+        "--teacher",
+        help="Trained model to distill from, e.g. the full model for a small --width-mult",
+    )
+    parser.add_argument(
+        "--distill-alpha",
+        type=float,
+        default=0.5,
+        help="Weight of the teacher outputs in the loss, the labels get 1 - alpha",
+    )
+    parser.add_argument("--epochs", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--val-batch-size", type=int, default=1024)
+    parser.add_argument("--seed", type=int, help="Seed for a reproducible run")
+    # Loader workers, run `python benchmark.py loader ...` to find the best value for this machine
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--log-every",
+        type=int,
+        default=10,
+        help="Log the step timing to TensorBoard every N steps",
+    )
 
-# Balanced dataset, not implementated
-image_paths = None
-steerings = None
+    # Fast CPU training, compare the epoch times and the val loss of the modes
+    parser.add_argument(
+        "--channels-last",
+        action="store_true",
+        help="Use the channels_last memory format for the model and the inputs",
+    )
+    parser.add_argument(
+        "--bf16",
+        action="store_true",
+        help="Run the forward pass under bf16 autocast if the device supports it",
+    )
+    parser.add_argument(
+        "--compile", action="store_true", help="Compile the model with torch.compile"
+    )
 
+    return parser.parse_args(argv)
 
-# Data preparation
-X_train, X_val, y_train, y_val = train_test_split(
-    image_paths, steerings, test_size=0.2, random_state=6
-)
 
-train_set = DrivingRecordDataset(X_train, y_train, transform, flip_transform)
-val_set = DrivingRecordDataset(X_val, y_val, transform, flip_transform)
+def train_one_epoch(
+    model,
+    loader,
+    optimizer,
+    criterion,
+    device,
+    args,
+    desc=None,
+    writer=None,
+    epoch=0,
+    progress=True,
+    teacher=None,
+) -> float:
+    """
+    Train the model for one epoch.
 
-train_loader = torch.utils.data.DataLoader(train_set, batch_size=128, shuffle=True)
-val_loader = torch.utils.data.DataLoader(val_set, batch_size=64, shuffle=True)
+    The time of every step is split into data wait, forward, backward and optimizer step and logged to
+    TensorBoard together with the throughput and the peak RSS, to tell whether a slow epoch comes from
+    the data pipeline or from the compute.
 
-# Model, optimizer and loss function
-model = NvidiaModel()
-model.to(device)
-optimizer = optim.Adam(model.parameters(), lr=1e-3)
-criterion = nn.MSELoss()
+    With a `teacher` model, the loss is a mix of the error against the teacher outputs (weighted by
+    `args.distill_alpha`) and against the labels (knowledge distillation).
 
-# Training loop
-num_epochs = 100
-for epoch in range(num_epochs):
+    Returns:
+        float: The average training loss.
+    """
     model.train()
     running_loss = 0.0
+    num_samples = 0
+
+    timer = StepTimer(sync=torch.cuda.synchronize if device.type == "cuda" else None)
+    epoch_start = time.perf_counter()
+    timer.start()
+
+    for step, (inputs, labels) in enumerate(
+        tqdm(loader, desc=desc, disable=not progress)
+    ):
+        inputs = to_device(inputs, device, args.channels_last)
+        labels = labels.to(device, non_blocking=True)
+        timer.lap("data")
 
-    for inputs, labels in tqdm(train_loader, desc=f"Epoch {epoch+1}/{num_epochs}"):
         optimizer.zero_grad()
-        outputs = model(inputs)
-        loss = criterion(outputs, labels)
+        with autocast(device, args.bf16):
+            outputs = model(inputs)
+            if teacher is not None:
+                with torch.no_grad():
+                    teacher_outputs = teacher(inputs)
+        loss = criterion(outputs.float(), labels)
+        if teacher is not None:
+            loss = (1 - args.distill_alpha) * loss + args.distill_alpha * criterion(
+                outputs.float(), teacher_outputs.float()
+            )
+        timer.lap("forward")
+
         loss.backward()
+        timer.lap("backward")
+
         optimizer.step()
+        timer.lap("optimizer")
 
         running_loss += loss.item()
+        num_samples += len(inputs)
+        global_step = epoch * len(loader) + step + 1
 
-    avg_train_loss = running_loss / len(train_loader)
+        if writer is not None and global_step % args.log_every == 0:
+            for name, duration in timer.durations.items():
+                writer.add_scalar(f"Step/{name}_ms", duration * 1000, global_step)
+            step_time = sum(timer.durations.values())
+            writer.add_scalar(
+                "Step/samples_per_sec", len(inputs) / step_time, global_step
+            )
 
-    # Validation
+        timer.start()  # Excludes the logging above from the data wait
+
+    if writer is not None:
+        # Share of every phase in the epoch and the overall throughput
+        epoch_time = time.perf_counter() - epoch_start
+        for name, total in timer.totals.items():
+            writer.add_scalar(f"Epoch/{name}_fraction", total / epoch_time, epoch)
+        writer.add_scalar("Epoch/samples_per_sec", num_samples / epoch_time, epoch)
+
+        rss = peak_rss_mb()
+        if rss is not None:
+            writer.add_scalar("Memory/peak_rss_mb", rss, epoch)
+
+    return running_loss / len(loader)
+
+
+def evaluate(model, images, labels, criterion, device, args) -> float:
+    """
+    Return the validation loss of the model on preprocessed, augmentation-free tensors.
+
+    The whole validation set is already in memory, so it is scored in a few large batches.
+    """
     model.eval()
     val_loss = 0.0
 
-    with torch.no_grad():
-        for inputs, labels in val_loader:
-            outputs = model(inputs)
-            loss = criterion(outputs, labels)
-            val_loss += loss.item()
+    with torch.inference_mode():
+        for start in range(0, len(images), args.val_batch_size):
+            inputs = images[start : start + args.val_batch_size]
+            targets = labels[start : start + args.val_batch_size]
 
-    avg_val_loss = val_loss / len(val_loader)
+            with autocast(device, args.bf16):
+                outputs = model(inputs)
+            # Weight by the batch size, the last batch may be smaller
+            val_loss += criterion(outputs.float(), targets).item() * len(inputs)
 
-    writer.add_scalar("Loss/train", avg_train_loss, epoch)
-    writer.add_scalar("Loss/val", avg_val_loss, epoch)
+    return val_loss / len(images)
 
-    print(
-        f"Epoch {epoch+1}/{num_epochs}, Train Loss: {avg_train_loss:.4f}, Val Loss: {avg_val_loss:.4f}"
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+        torch.manual_seed(args.seed)
+
+    if args.bf16 and not bf16_supported(device):
+        print(f"bf16 is not supported on {device}, falling back to fp32")
+        args.bf16 = False
+
+    # Balanced dataset, e.g. the output of `balance_dataset` or `balance_csv`
+    df = pd.read_csv(args.labels)
+    image_paths = list(df["file_path"])
+    steerings = list(df["distance"])
+
+    cache = FrameCache(args.cache_dir, image_paths) if args.cache_dir else None
+
+    # Data preparation
+    X_train, X_val, y_train, y_val = train_test_split(
+        image_paths, steerings, test_size=0.2, random_state=6
+    )
+
+    # Training samples are augmented by batch, see `augment` below
+    train_set = DrivingRecordDataset(X_train, y_train, cache=cache)
+
+    # Validation samples are preprocessed once without augmentation and kept in memory
+    val_images, val_labels = load_tensor_dataset(X_val, y_val, cache)
+    val_images = to_device(val_images, device, args.channels_last)
+    val_labels = val_labels.to(device)
+
+    augment = BatchAugmentation()
+
+    train_loader = create_data_loader(
+        train_set,
+        batch_size=args.batch_size,
+        shuffle=True,
+        num_workers=args.workers,
+        # Restarted in every epoch and seeded from the torch generator, which is checkpointed, so
+        # --resume continues the augmentations exactly. Persistent workers would keep generators
+        # which no checkpoint can restore
+        persistent_workers=False,
+        collate_fn=augment.collate,  # Augment by batch in the loader workers
+    )
+
+    # Model, optimizer and loss function
+    model = NvidiaModel(args.width_mult, args.depth_mult)
+    model.to(device)
+    optimizer = optim.Adam(model.parameters(), lr=args.lr)
+    criterion = nn.MSELoss()
+
+    # Continue from the last checkpoint, including the TensorBoard run of the interrupted training
+    last_path = os.path.join(args.checkpoint_dir, "last.pth")
+    best_path = os.path.join(args.checkpoint_dir, "best.pth")
+    start_epoch, best_val_loss, log_dir = 0, float("inf"), None
+
+    if args.resume:
+        checkpoint = load_checkpoint(last_path, map_location=device)
+        model.load_state_dict(checkpoint["model"])
+        optimizer.load_state_dict(checkpoint["optimizer"])
+        start_epoch = checkpoint["epoch"] + 1
+        best_val_loss = checkpoint["best_val_loss"]
+        log_dir = checkpoint["log_dir"]
+        restore_rng_state(checkpoint["rng_state"])
+        print(f"Resuming from {last_path} at epoch {start_epoch + 1}")
+
+    # TensorBoard, visualize the log by running: `tensorboard --logdir=runs`
+    writer = SummaryWriter(log_dir=log_dir)
+    checkpoint_writer = CheckpointWriter()
+
+    # `train_model` shares its parameters with `model`
+    train_model = optimize_model(model, args.channels_last, args.compile)
+
+    teacher = None
+    if args.teacher is not None:
+        state = load_checkpoint(args.teacher, map_location=device)
+        teacher = NvidiaModel.from_state_dict(state.get("model", state)).to(device)
+        teacher = optimize_model(teacher.eval(), args.channels_last)
+        num_params = [sum(p.numel() for p in m.parameters()) for m in (teacher, model)]
+        print(
+            f"Distilling from {args.teacher} ({num_params[0]} -> {num_params[1]} parameters)"
+        )
+
+    mode = ", ".join(
+        name
+        for name, enabled in [
+            ("channels_last", args.channels_last),
+            ("bf16", args.bf16),
+            ("compile", args.compile),
+        ]
+        if enabled
     )
+    print(f"Training on {device} ({mode or 'fp32, eager'})")
+
+    # Training loop
+    num_epochs = args.epochs
+    for epoch in range(start_epoch, num_epochs):
+        epoch_start = time.perf_counter()
+
+        avg_train_loss = train_one_epoch(
+            train_model,
+            train_loader,
+            optimizer,
+            criterion,
+            device,
+            args,
+            desc=f"Epoch {epoch+1}/{num_epochs}",
+            writer=writer,
+            epoch=epoch,
+            teacher=teacher,
+        )
+
+        # Validation
+        avg_val_loss = evaluate(
+            train_model, val_images, val_labels, criterion, device, args
+        )
 
-writer.close()
+        epoch_time = time.perf_counter() - epoch_start
 
+        writer.add_scalar("Loss/train", avg_train_loss, epoch)
+        writer.add_scalar("Loss/val", avg_val_loss, epoch)
+        writer.add_scalar("Time/epoch", epoch_time, epoch)
+
+        print(
+            f"Epoch {epoch+1}/{num_epochs}, Train Loss: {avg_train_loss:.4f}, Val Loss: {avg_val_loss:.4f}, Time: {epoch_time:.1f}s"
+        )
+
+        # Checkpoints are written on a background thread
+        is_best = avg_val_loss < best_val_loss
+        best_val_loss = min(best_val_loss, avg_val_loss)
+        last_epoch = epoch == num_epochs - 1
+
+        if is_best or (epoch + 1) % args.checkpoint_every == 0 or last_epoch:
+            checkpoint = {
+                "model": model.state_dict(),
+                "optimizer": optimizer.state_dict(),
+                "epoch": epoch,
+                "val_loss": avg_val_loss,
+                "best_val_loss": best_val_loss,
+                "log_dir": writer.log_dir,
+                "rng_state": capture_rng_state(),
+            }
+            if (epoch + 1) % args.checkpoint_every == 0 or last_epoch:
+                checkpoint_writer.save(checkpoint, last_path)
+            if is_best:
+                checkpoint_writer.save(checkpoint, best_path)
+
+    checkpoint_writer.close()
+    writer.close()
+
+    # Loading and saving models
+    torch.save(model.state_dict(), args.output)
+
+    model = NvidiaModel.from_state_dict(torch.load(args.output))
+    model.eval()
 
-# Loading and saving models
-torch.save(model.state_dict(), "../model.pth")
 
-model = NvidiaModel()
-model.load_state_dict(torch.load("../model.pth"))
-model.eval()
+if __name__ == "__main__":
+    main()